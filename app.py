@@ -1,12 +1,19 @@
+import logging
 import os
 import time
 
 import streamlit as st
 
+from domain.governor import governor
+from domain.result_store import result_store
 from interface.pages.focus import focus_view
 from interface.pages.home import home_view
 from interface.pages.insights import insights_view
 from interface.pages.trips import trips_view
+from interface.session import is_session_active
+
+# Progress of the queries, the caches and the API latencies (see domain.api)
+logging.basicConfig(level=logging.INFO)
 
 # SET TIMEZONE AS Europe/Brussels
 os.environ["TZ"] = "Europe/Brussels"
@@ -16,6 +23,11 @@ time.tzset()
 def main():
     st.set_page_config(page_title="STIB Speed Analysis")
 
+    # Queries of the sessions that disconnected are interrupted
+    governor.session_alive = is_session_active
+    # Results of the sessions that disconnected are dropped
+    result_store.session_alive = is_session_active
+
     st.logo("https://mobilitytwin.brussels/static/logo.png", size="large")
 
     home = st.Page(
@@ -0,0 +1,134 @@
+import argparse
+import time
+
+import geopandas
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from shapely.geometry import LineString, Point
+
+from domain.helpers import aggregate_results, speed_column
+from domain.pipeline import (
+    SpeedComputationMode,
+    by_mode_frame,
+    count_column,
+    sum_column,
+)
+
+# Compare the assembly of the results of a full line (every stop) over growing periods:
+#   python -m benchmarks.assembly --days 30 365
+
+
+def create_stops(stops: int) -> geopandas.GeoDataFrame:
+    # Selected stops merged with their segments, like _select_stops returns them
+    return geopandas.GeoDataFrame(
+        {
+            "stop_id": np.arange(2000, 2000 + stops),
+            "prev_stop_id": np.arange(1000, 1000 + stops),
+            "stop_name": [f"Stop {i}" for i in range(stops)],
+            "prev_stop_name": [f"Stop {i - 1}" for i in range(stops)],
+            "segment_name": [f"Stop {i - 1} -> Stop {i}" for i in range(stops)],
+            "lineId": "60",
+            "direction": "V",
+            "stop_sequence": np.arange(stops),
+            "line_id": "60",
+            "start": np.arange(1000, 1000 + stops),
+            "distance": np.arange(stops) * 400.0,
+            "delta_distance": 400.0,
+            "geometry_x": geopandas.GeoSeries(
+                [Point(4.3 + i * 1e-3, 50.8) for i in range(stops)]
+            ),
+            "geometry_y": geopandas.GeoSeries(
+                [
+                    LineString([(4.3 + i * 1e-3, 50.8), (4.301 + i * 1e-3, 50.8)])
+                    for i in range(stops)
+                ]
+            ),
+        },
+        geometry="geometry_x",
+    )
+
+
+def create_results(stops: int, days: int, seed: int = 0) -> pd.DataFrame:
+    # Wide results (BY_MODE_COLUMNS) of every 15 minutes bucket, point and direction
+    rng = np.random.default_rng(seed)
+    buckets = pd.date_range("2024-01-01", periods=days * 96, freq="15min")
+    points = np.arange(1000, 1000 + stops)
+    directions = np.array(["3000", "3001"])
+    index = pd.MultiIndex.from_product(
+        [directions, points, buckets], names=["directionId", "pointId", "date"]
+    )
+    results = index.to_frame(index=False)
+    results.insert(0, "lineId", "60")
+    for mode in SpeedComputationMode:
+        counts = rng.integers(0, 30, len(results))
+        results[sum_column(mode)] = counts * rng.uniform(0, 12, len(results))
+        results[count_column(mode)] = counts
+    return by_mode_frame(pa.Table.from_pandas(results, preserve_index=False))
+
+
+def aggregate_on_every_column(selected_stops, results):
+    # Previous assembly: merge first, then group on every stop attribute and geometry
+    for mode in SpeedComputationMode:
+        results[speed_column(mode)] = (
+            results[sum_column(mode)] / results[count_column(mode)] * 3.6
+        )
+    results = results.drop(columns=[sum_column(mode) for mode in SpeedComputationMode])
+    results["pointId"] = results["pointId"].astype(int)
+    results = selected_stops.merge(
+        results, left_on="prev_stop_id", right_on="pointId", how="right"
+    )
+    aggregations = {}
+    for mode in SpeedComputationMode:
+        aggregations[count_column(mode)] = "sum"
+        aggregations[speed_column(mode)] = "mean"
+    aggregations["directionId"] = "first"
+    group_by_cols = results.columns[~results.columns.isin(list(aggregations))]
+    return (
+        results.groupby(list(group_by_cols), observed=True)
+        .agg(aggregations)
+        .reset_index()
+    )
+
+
+def run(assemble, selected_stops, results, repeat):
+    timings = []
+    for _ in range(repeat):
+        results_copy = results.copy()
+        start = time.perf_counter()
+        assembled = assemble(selected_stops, results_copy)
+        timings.append(time.perf_counter() - start)
+    return min(timings), assembled
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the results assembly")
+    parser.add_argument("--days", type=int, nargs="+", default=[30, 90, 365])
+    parser.add_argument("--stops", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    selected_stops = create_stops(args.stops)
+    print(f"{'days':>6} {'rows':>10} {'every column':>13} {'keys':>9} {'speedup':>8}")
+    for days in args.days:
+        results = create_results(args.stops, days)
+        legacy_time, legacy = run(
+            aggregate_on_every_column, selected_stops, results, args.repeat
+        )
+        keyed_time, keyed = run(aggregate_results, selected_stops, results, args.repeat)
+
+        # Same rows and values, only the column order differs
+        sort_by = ["prev_stop_id", "date"]
+        legacy = legacy[keyed.columns].sort_values(sort_by).reset_index(drop=True)
+        keyed = keyed.sort_values(sort_by).reset_index(drop=True)
+        pd.testing.assert_frame_equal(
+            pd.DataFrame(legacy), pd.DataFrame(keyed), check_dtype=False
+        )
+        print(
+            f"{days:>6} {len(results):>10} {legacy_time:>12.3f}s {keyed_time:>8.3f}s "
+            f"{legacy_time / keyed_time:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import argparse
+import time
+
+import duckdb
+import numpy as np
+
+from domain.engines import ENGINES
+from domain.pipeline import BY_MODE_COLUMNS
+
+# Compare the speed engines on synthetic entries of growing size:
+#   python -m benchmarks.engines --sizes 100000 1000000 10000000
+
+
+def create_entries(con: duckdb.DuckDBPyConnection, rows: int, points: int = 40):
+    # One point every ~10 seconds per (point, direction), with some duplicated timestamps
+    con.execute(
+        f"""CREATE OR REPLACE TABLE synthetic_entries AS
+        SELECT
+            '60' AS lineId,
+            (1000 + i % {points})::VARCHAR AS pointId,
+            (2000 + (i // {points}) % 2)::VARCHAR AS directionId,
+            (random() * 700)::DOUBLE AS distanceFromPoint,
+            TIMESTAMP '2024-01-01' + to_seconds((i // ({points} * 2)) * 10 + (i % 7 = 0)::INT) AS local_date
+        FROM range({rows}) t(i)
+        """
+    )
+
+
+def run(con, engine, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results_df = ENGINES[engine].compute(con, "SELECT * FROM synthetic_entries")
+        timings.append(time.perf_counter() - start)
+    return min(timings), results_df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the speed engines")
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[100_000, 1_000_000, 5_000_000]
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    con = duckdb.connect()
+    keys = ["lineId", "directionId", "pointId", "date"]
+    aggregates = [column for column in BY_MODE_COLUMNS if column not in keys]
+    print(f"{'rows':>12} " + " ".join(f"{e:>10}" for e in ENGINES))
+    for rows in args.sizes:
+        create_entries(con, rows)
+        timings = []
+        reference = None
+        for engine in ENGINES:
+            elapsed, results_df = run(con, engine, args.repeat)
+            timings.append(elapsed)
+            results_df = results_df.sort_values(keys).reset_index(drop=True)
+            if reference is None:
+                reference = results_df
+            # Every engine must give the same buckets as the first one, a sum without
+            # any speed is either 0 or NULL
+            assert len(results_df) == len(reference)
+            assert np.allclose(
+                results_df[aggregates].fillna(0).astype(float),
+                reference[aggregates].fillna(0).astype(float),
+            )
+        print(f"{rows:>12} " + " ".join(f"{t:>9.3f}s" for t in timings))
+
+
+if __name__ == "__main__":
+    main()
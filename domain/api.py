@@ -0,0 +1,152 @@
+import logging
+import statistics
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Any
+from urllib.parse import urlsplit
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from domain.config import (
+    API_BACKOFF_SECONDS,
+    API_POOL_SIZE,
+    API_RETRIES,
+    API_STATS_LOG_SECONDS,
+    API_TIMEOUT_SECONDS,
+    API_TOKEN,
+    API_URL,
+)
+
+# Latencies kept per endpoint for the statistics
+LATENCY_SAMPLES = 1000
+
+
+class ApiClient:
+    """Client of the mobilitytwin API shared by every page and worker thread.
+
+    Requests go through one ``requests.Session`` whose connections are kept alive
+    and pooled per host, failed requests (connection errors, 429 and 5xx) are retried
+    with exponential backoff. The latency of every request is recorded per endpoint
+    (the host for the signed urls of the files), see ``latency_stats``, and logged
+    every ``stats_log_seconds``.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        token: str,
+        timeout: float,
+        retries: int,
+        backoff: float,
+        pool_size: int,
+        stats_log_seconds: int = 0,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.token = token
+        self.timeout = timeout
+        self.stats_log_seconds = stats_log_seconds
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=("GET",),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._latencies = defaultdict(lambda: deque(maxlen=LATENCY_SAMPLES))
+        self._errors = defaultdict(int)
+        self._logged_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _url(self, path: str) -> str:
+        return path if "://" in path else f"{self.base_url}/{path.lstrip('/')}"
+
+    def _headers(self, url: str) -> dict:
+        # The token only goes to the API, not to the signed urls of the files
+        if url.startswith(self.base_url):
+            return {"Authorization": f"Bearer {self.token}"}
+        return {}
+
+    def get(self, path: str, params=None, headers=None, **kwargs) -> requests.Response:
+        url = self._url(path)
+        # Every file has its own signed url, they are grouped by host
+        parts = urlsplit(url)
+        endpoint = parts.path if url.startswith(self.base_url) else parts.netloc
+        start = time.perf_counter()
+        try:
+            response = self.session.get(
+                url,
+                params=params,
+                headers={**self._headers(url), **(headers or {})},
+                timeout=kwargs.pop("timeout", self.timeout),
+                **kwargs,
+            )
+        except requests.RequestException:
+            with self._lock:
+                self._errors[endpoint] += 1
+            raise
+        with self._lock:
+            self._latencies[endpoint].append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                self._errors[endpoint] += 1
+            log_stats = (
+                self.stats_log_seconds
+                and time.monotonic() - self._logged_at > self.stats_log_seconds
+            )
+            if log_stats:
+                self._logged_at = time.monotonic()
+        if log_stats:
+            stats = self.latency_stats().to_string(index=False, float_format="%.3f")
+            logging.info(f"API latencies (seconds):\n{stats}")
+        return response
+
+    def get_json(self, path: str, params=None) -> Any:
+        response = self.get(path, params=params)
+        response.raise_for_status()
+        return response.json()
+
+    def latency_stats(self) -> pd.DataFrame:
+        # Requests, errors and latency percentiles (seconds) of every endpoint called
+        with self._lock:
+            samples = {
+                endpoint: list(values) for endpoint, values in self._latencies.items()
+            }
+            errors = dict(self._errors)
+        rows = []
+        for endpoint in sorted(set(samples) | set(errors)):
+            values = sorted(samples.get(endpoint, []))
+            rows.append(
+                {
+                    "endpoint": endpoint,
+                    "requests": len(values),
+                    "errors": errors.get(endpoint, 0),
+                    "mean": statistics.fmean(values) if values else None,
+                    "p50": values[len(values) // 2] if values else None,
+                    "p95": values[int(len(values) * 0.95)] if values else None,
+                    "max": values[-1] if values else None,
+                }
+            )
+        columns = ["endpoint", "requests", "errors", "mean", "p50", "p95", "max"]
+        return pd.DataFrame(rows, columns=columns)
+
+
+api = ApiClient(
+    API_URL,
+    API_TOKEN,
+    API_TIMEOUT_SECONDS,
+    API_RETRIES,
+    API_BACKOFF_SECONDS,
+    API_POOL_SIZE,
+    API_STATS_LOG_SECONDS,
+)
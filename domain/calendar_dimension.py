@@ -0,0 +1,33 @@
+from functools import lru_cache
+from typing import List
+
+import duckdb
+import pandas as pd
+
+CALENDAR_PATH = "static/calendar.csv"
+
+
+@lru_cache(maxsize=1)
+def get_calendar_table() -> pd.DataFrame:
+    # Loaded once per process, CALENDAR_DATE is kept as datetime64 so DuckDB can scan it directly
+    calendar_df = pd.read_csv(CALENDAR_PATH, usecols=["CALENDAR_DATE", "DAY_TYPE"])
+    calendar_df["CALENDAR_DATE"] = pd.to_datetime(
+        calendar_df["CALENDAR_DATE"], format="%Y-%m-%d"
+    )
+    return calendar_df
+
+
+def excluded_days_frame(excluded_periods: List[tuple]) -> pd.DataFrame:
+    # One row per excluded day, whatever the number and length of the periods
+    if not excluded_periods:
+        return pd.DataFrame({"day": pd.Series([], dtype="datetime64[ns]")})
+    days = pd.concat(
+        [pd.Series(pd.date_range(start, end)) for start, end in excluded_periods]
+    )
+    return pd.DataFrame({"day": days.drop_duplicates().values})
+
+
+def register_calendar(con: duckdb.DuckDBPyConnection, excluded_periods: List[tuple] = ()):
+    # Expose the calendar dimension and the excluded days as tables of the connection
+    con.register("calendar", get_calendar_table())
+    con.register("excluded_days", excluded_days_frame(list(excluded_periods)))
@@ -0,0 +1,121 @@
+import os
+
+# Root directory for everything the app persists locally (caches, datasets, ...)
+DATA_DIRECTORY = os.environ.get(
+    "STIB_DATA_DIRECTORY",
+    os.path.join(os.path.expanduser("~"), ".cache", "stib_speed_analysis"),
+)
+
+# mobilitytwin API shared by every page, see domain.api
+API_URL = os.environ.get("STIB_API_URL", "https://api.mobilitytwin.brussels")
+API_TOKEN = os.environ.get(
+    "STIB_API_TOKEN",
+    "42227799ae2e74ebc42ca66dee38f4352456c2e93a21962133e0056fd228392eecd70222df0a0c3882438acdfb59de933c50ef368cebb8f5ab8b19d3bd8d2134",
+)
+API_TIMEOUT_SECONDS = float(os.environ.get("STIB_API_TIMEOUT_SECONDS", 60))
+# Retries of failed requests (connection errors, 429 and 5xx), with exponential backoff
+API_RETRIES = int(os.environ.get("STIB_API_RETRIES", 3))
+API_BACKOFF_SECONDS = float(os.environ.get("STIB_API_BACKOFF_SECONDS", 0.5))
+# Keep-alive connections kept open per host
+API_POOL_SIZE = int(os.environ.get("STIB_API_POOL_SIZE", 16))
+# Request count, errors and latency percentiles per endpoint are logged this often,
+# 0 disables the log
+API_STATS_LOG_SECONDS = int(os.environ.get("STIB_API_STATS_LOG_SECONDS", 15 * 60))
+
+# Processed stops and segments tables persisted as GeoParquet, see domain.snapshots
+SNAPSHOT_DIRECTORY = os.environ.get(
+    "STIB_SNAPSHOT_DIRECTORY", os.path.join(DATA_DIRECTORY, "snapshots")
+)
+# The snapshots are revalidated against the API in the background after this long
+SNAPSHOT_REFRESH_SECONDS = int(os.environ.get("STIB_SNAPSHOT_REFRESH_SECONDS", 3600))
+
+# Local copies of the parquet files returned by the parquetized endpoint
+PARQUET_CACHE_DIRECTORY = os.environ.get(
+    "STIB_PARQUET_CACHE_DIRECTORY", os.path.join(DATA_DIRECTORY, "parquet")
+)
+# Byte budget of the parquet cache, 0 disables the cache
+PARQUET_CACHE_MAX_BYTES = int(
+    os.environ.get("STIB_PARQUET_CACHE_MAX_BYTES", 20 * 1024**3)
+)
+PARQUET_CACHE_DOWNLOAD_WORKERS = int(
+    os.environ.get("STIB_PARQUET_CACHE_DOWNLOAD_WORKERS", 8)
+)
+# Files used this recently are never evicted, a query (possibly in another process)
+# may be about to open them
+PARQUET_CACHE_GRACE_SECONDS = int(
+    os.environ.get("STIB_PARQUET_CACHE_GRACE_SECONDS", 30 * 60)
+)
+
+# Re-encoded vehicle distance data, hive-partitioned by lineId and month
+WAREHOUSE_DIRECTORY = os.environ.get(
+    "STIB_WAREHOUSE_DIRECTORY", os.path.join(DATA_DIRECTORY, "warehouse")
+)
+
+# DuckDB database holding the 15 minutes speed rollups
+ROLLUP_DATABASE_PATH = os.environ.get(
+    "STIB_ROLLUP_DATABASE_PATH", os.path.join(DATA_DIRECTORY, "rollups.duckdb")
+)
+
+# Time coverage, row count and lines of every parquetized file seen so far
+MANIFEST_PATH = os.environ.get(
+    "STIB_MANIFEST_PATH", os.path.join(DATA_DIRECTORY, "manifest.parquet")
+)
+
+# Heavy queries running at the same time, the others wait in line, see domain.governor
+MAX_CONCURRENT_QUERIES = int(os.environ.get("STIB_MAX_CONCURRENT_QUERIES", 2))
+# Wall-clock budget of a query once admitted, 0 disables the timeout
+QUERY_TIMEOUT_SECONDS = int(os.environ.get("STIB_QUERY_TIMEOUT_SECONDS", 10 * 60))
+# DuckDB memory of a query, the database gets one budget per admitted query. 0 leaves
+# the memory limit to STIB_DUCKDB_MEMORY_LIMIT
+QUERY_MEMORY_BUDGET_BYTES = int(
+    os.environ.get("STIB_QUERY_MEMORY_BUDGET_BYTES", 2 * 1024**3)
+)
+
+# Engine computing the speeds from raw data, one of domain.engines.ENGINES ("sql" or
+# "arrow", see python -m benchmarks.engines)
+SPEED_ENGINE = os.environ.get("STIB_SPEED_ENGINE", "sql")
+
+# Process-wide DuckDB database shared by the queries, see domain.database
+DUCKDB_THREADS = int(os.environ.get("STIB_DUCKDB_THREADS", os.cpu_count() or 1))
+# Any DuckDB memory size ("4GB", "75%", ...), empty keeps the DuckDB default
+DUCKDB_MEMORY_LIMIT = os.environ.get(
+    "STIB_DUCKDB_MEMORY_LIMIT",
+    (
+        f"{QUERY_MEMORY_BUDGET_BYTES * MAX_CONCURRENT_QUERIES}B"
+        if QUERY_MEMORY_BUDGET_BYTES
+        else ""
+    ),
+)
+# Where operators spill when the memory limit is reached
+DUCKDB_TEMP_DIRECTORY = os.environ.get(
+    "STIB_DUCKDB_TEMP_DIRECTORY", os.path.join(DATA_DIRECTORY, "duckdb_tmp")
+)
+# Keep parquet footers and metadata in memory between queries
+DUCKDB_OBJECT_CACHE = os.environ.get("STIB_DUCKDB_OBJECT_CACHE", "1") == "1"
+
+# Results shared between the sessions of the server, see domain.result_cache
+RESULT_CACHE_TTL_SECONDS = int(os.environ.get("STIB_RESULT_CACHE_TTL_SECONDS", 15 * 60))
+# Byte budget of the cached results, 0 disables the cache
+RESULT_CACHE_MAX_BYTES = int(
+    os.environ.get("STIB_RESULT_CACHE_MAX_BYTES", 512 * 1024**2)
+)
+
+# Results held by the sessions of the server, see domain.result_store. Over this many
+# bytes in memory the least recently used ones are spilled to disk
+RESULT_STORE_MAX_BYTES = int(os.environ.get("STIB_RESULT_STORE_MAX_BYTES", 1024**3))
+# Results not used for this long are spilled as well
+RESULT_STORE_IDLE_SECONDS = int(os.environ.get("STIB_RESULT_STORE_IDLE_SECONDS", 600))
+RESULT_STORE_DIRECTORY = os.environ.get(
+    "STIB_RESULT_STORE_DIRECTORY", os.path.join(DATA_DIRECTORY, "results")
+)
+
+# Per day speed sums and counts of past days reused across queries, 0 bytes disables it
+DAY_CACHE_TTL_SECONDS = int(os.environ.get("STIB_DAY_CACHE_TTL_SECONDS", 24 * 3600))
+DAY_CACHE_MAX_BYTES = int(os.environ.get("STIB_DAY_CACHE_MAX_BYTES", 1024**3))
+
+# Disjoint periods of a query computed at the same time, shared by every session
+QUERY_WORKERS = int(os.environ.get("STIB_QUERY_WORKERS", 4))
+
+# Worker processes running the analyses out of the Streamlit server, 0 runs them in the
+# script thread of the session
+JOB_WORKERS = int(os.environ.get("STIB_JOB_WORKERS", 2))
@@ -0,0 +1,57 @@
+import threading
+
+import duckdb
+
+from domain.config import (
+    DUCKDB_MEMORY_LIMIT,
+    DUCKDB_OBJECT_CACHE,
+    DUCKDB_TEMP_DIRECTORY,
+    DUCKDB_THREADS,
+)
+
+
+class Database:
+    """Long-lived in-memory DuckDB database with one cursor per thread.
+
+    All the cursors share the database: its thread pool and memory limit bound the
+    concurrent queries of every user together, and the object cache keeps the parquet
+    metadata warm between requests. Registered dataframes and temporary tables are
+    local to a cursor, so each thread can register its own.
+    """
+
+    def __init__(
+        self,
+        threads: int,
+        memory_limit: str = "",
+        temp_directory: str = "",
+        object_cache: bool = True,
+    ):
+        self.config = {"threads": threads, "enable_object_cache": object_cache}
+        if memory_limit:
+            self.config["memory_limit"] = memory_limit
+        if temp_directory:
+            self.config["temp_directory"] = temp_directory
+        self._connection = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def connection(self) -> duckdb.DuckDBPyConnection:
+        # Opened on first use, importing the module does not start DuckDB
+        with self._lock:
+            if self._connection is None:
+                self._connection = duckdb.connect(config=self.config)
+            return self._connection
+
+    def cursor(self) -> duckdb.DuckDBPyConnection:
+        # The cursor of the calling thread, a DuckDB connection must not be shared between threads
+        cursor = getattr(self._local, "cursor", None)
+        if cursor is None:
+            cursor = self.connection.cursor()
+            self._local.cursor = cursor
+        return cursor
+
+
+database = Database(
+    DUCKDB_THREADS, DUCKDB_MEMORY_LIMIT, DUCKDB_TEMP_DIRECTORY, DUCKDB_OBJECT_CACHE
+)
@@ -0,0 +1,157 @@
+import duckdb
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from domain.pipeline import (
+    SpeedComputationMode,
+    by_mode_frame,
+    count_column,
+    mode_aggregates_sql,
+    speed_table_sql,
+    sum_column,
+)
+
+# Same gate as speedTable in speed_table_sql
+MAX_TIME_DELTA_SECONDS = 30
+MAX_DISTANCE_DELTA = 600
+BUCKET_MICROSECONDS = 15 * 60 * 1_000_000
+
+
+class SpeedEngine:
+    """Turns the entries of a query into speed sums and counts per 15 minutes bucket.
+
+    ``entries`` is the SQL returned by ``entries_sql``, the result has one row per
+    (lineId, directionId, pointId, bucket) with the BY_MODE_COLUMNS columns, a sum and
+    a count for every speed computation mode, typed like ``by_mode_frame``.
+    """
+
+    name: str
+
+    def compute(self, con: duckdb.DuckDBPyConnection, entries: str) -> pd.DataFrame:
+        raise NotImplementedError
+
+
+class SqlEngine(SpeedEngine):
+    # Dedupe, lag() and aggregation as stacked DuckDB window passes
+    name = "sql"
+
+    def compute(self, con, entries):
+        query = f"""{speed_table_sql(entries)}
+        SELECT  lineId, directionId, pointId, time_bucket(interval '15 minutes', local_date) as agg,
+        {mode_aggregates_sql()}
+        FROM speedTable
+        GROUP BY lineId, directionId, pointId, agg
+        """
+        return by_mode_frame(con.execute(query).fetch_arrow_table())
+
+
+class ArrowEngine(SpeedEngine):
+    # DuckDB only sorts the entries, everything else is a single vectorized pass over the arrays
+    name = "arrow"
+
+    def compute(self, con, entries):
+        table = con.execute(
+            f"""SELECT lineId, pointId, directionId, distanceFromPoint, local_date
+            FROM ({entries})
+            ORDER BY lineId, pointId, directionId, local_date
+            """
+        ).fetch_arrow_table()
+        n = table.num_rows
+        if n == 0:
+            return self._empty(table)
+
+        timestamps = pc.cast(
+            pc.cast(table["local_date"], pa.timestamp("us")), pa.int64()
+        ).to_numpy()
+        distances = table["distanceFromPoint"].to_numpy()
+
+        # A partition (line, point, direction) starts wherever one of its keys changes
+        partition_start = np.zeros(n, dtype=bool)
+        partition_start[0] = True
+        for column in ("lineId", "pointId", "directionId"):
+            values = table[column]
+            partition_start[1:] |= pc.not_equal(values[1:], values[:-1]).to_numpy()
+
+        # Rows sharing their timestamp with another row of the partition are dropped
+        duplicated = ~partition_start[1:] & (timestamps[1:] == timestamps[:-1])
+        keep = np.ones(n, dtype=bool)
+        keep[1:] &= ~duplicated
+        keep[:-1] &= ~duplicated
+
+        kept = np.flatnonzero(keep)
+        partition_id = np.cumsum(partition_start)[kept]
+        kept_timestamps = timestamps[kept]
+        kept_distances = distances[kept]
+
+        # lag() deltas, the first row of each partition has no previous row
+        has_previous = partition_id[1:] == partition_id[:-1]
+        time_delta = (kept_timestamps[1:] - kept_timestamps[:-1]) / 1_000_000
+        distance_delta = kept_distances[1:] - kept_distances[:-1]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            speed = distance_delta / time_delta
+
+        selected = (
+            has_previous
+            & (time_delta < MAX_TIME_DELTA_SECONDS)
+            & (distance_delta < MAX_DISTANCE_DELTA)
+        )
+
+        rows = kept[1:][selected]
+        speed = speed[selected]
+        distance_from_point = kept_distances[1:][selected]
+        partition_id = partition_id[1:][selected]
+        bucket = kept_timestamps[1:][selected] // BUCKET_MICROSECONDS
+
+        if len(rows) == 0:
+            return self._empty(table)
+
+        # Rows are sorted by partition then time, so every bucket is a contiguous run
+        group_start = np.ones(len(rows), dtype=bool)
+        group_start[1:] = (partition_id[1:] != partition_id[:-1]) | (
+            bucket[1:] != bucket[:-1]
+        )
+        starts = np.flatnonzero(group_start)
+
+        first_rows = pa.array(rows[starts])
+        results = {
+            "lineId": table["lineId"].take(first_rows),
+            "directionId": table["directionId"].take(first_rows),
+            "pointId": table["pointId"].take(first_rows),
+            "date": (bucket[starts] * BUCKET_MICROSECONDS).astype("datetime64[us]"),
+        }
+        for mode in SpeedComputationMode:
+            mask = self._mode_mask(mode, speed, distance_from_point)
+            results[sum_column(mode)] = np.add.reduceat(np.where(mask, speed, 0), starts)
+            results[count_column(mode)] = np.add.reduceat(mask.astype(np.int64), starts)
+        return by_mode_frame(pa.table(results))
+
+    @staticmethod
+    def _mode_mask(speed_computation_mode, speed, distance_from_point):
+        # Same conditions as MAPPING_SPEED_COMPUTATION_MODE
+        with np.errstate(invalid="ignore"):
+            if speed_computation_mode == SpeedComputationMode.GREATER_THAN_ZERO:
+                return speed > 0
+            if (
+                speed_computation_mode
+                == SpeedComputationMode.GREATER_THAN_ZERO_IF_CLOSE_TO_STOP
+            ):
+                return (distance_from_point > 50) | (speed > 0)
+            return speed >= 0
+
+    @staticmethod
+    def _empty(table: pa.Table) -> pd.DataFrame:
+        results = {
+            "lineId": table["lineId"].slice(0, 0),
+            "directionId": table["directionId"].slice(0, 0),
+            "pointId": table["pointId"].slice(0, 0),
+            "date": pa.array([], type=pa.timestamp("us")),
+        }
+        for mode in SpeedComputationMode:
+            results[sum_column(mode)] = pa.array([], type=pa.float64())
+            results[count_column(mode)] = pa.array([], type=pa.int64())
+        return by_mode_frame(pa.table(results))
+
+
+ENGINES = {engine.name: engine for engine in (SqlEngine(), ArrowEngine())}
@@ -0,0 +1,257 @@
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+
+import duckdb
+
+from domain.config import MAX_CONCURRENT_QUERIES, QUERY_TIMEOUT_SECONDS
+
+# Seconds between two checks of the timeouts and of the sessions still connected
+WATCHDOG_INTERVAL_SECONDS = 1
+
+# Session the queries of the current context run for and callback receiving the position
+# in line while waiting, set by the interface with QueryGovernor.session
+_current_session = contextvars.ContextVar("current_session", default=None)
+_current_on_wait = contextvars.ContextVar("current_on_wait", default=None)
+# Ticket of the admitted query, the periods pool runs its tasks in a copy of the context
+_current_ticket = contextvars.ContextVar("current_ticket", default=None)
+
+
+class QueryCancelled(Exception):
+    # reason is "resubmitted", "disconnected", "timeout", "memory" or "abandoned"
+    def __init__(self, reason: str):
+        super().__init__(f"Query cancelled ({reason})")
+        self.reason = reason
+
+
+class Ticket:
+    # A query waiting for or holding a slot, with the DuckDB cursors it is running on
+    def __init__(self, session_id: Optional[str]):
+        self.session_id = session_id
+        self.reason: Optional[str] = None
+        self.admitted_at: Optional[float] = None
+        self._cursors = set()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.reason is not None
+
+    def cancel(self, reason: str):
+        with self._lock:
+            if self.reason is None:
+                self.reason = reason
+            for cursor in self._cursors:
+                cursor.interrupt()
+
+    def check(self):
+        if self.reason is not None:
+            raise QueryCancelled(self.reason)
+
+
+class QueryGovernor:
+    """Admission control of the heavy queries of the server.
+
+    At most ``max_concurrent`` queries run at the same time, the others wait in line
+    in arrival order. An admitted query is interrupted once it runs for longer than
+    ``timeout_seconds``, when its session submits another query or when
+    ``session_alive`` reports that the session is gone. Its memory is bounded by the
+    DuckDB memory limit, one QUERY_MEMORY_BUDGET_BYTES per slot.
+    """
+
+    def __init__(self, max_concurrent: int, timeout_seconds: int):
+        self.max_concurrent = max_concurrent
+        self.timeout_seconds = timeout_seconds
+        # Set by the interface, tells whether a session is still connected
+        self.session_alive: Optional[Callable[[str], bool]] = None
+        self._waiting: List[Ticket] = []
+        self._running = set()
+        # Session -> its latest ticket
+        self._sessions = {}
+        # Sessions whose work outside of the governor (jobs) is cancelled on disconnect
+        self._watched = {}
+        self._condition = threading.Condition()
+        self._watchdog: Optional[threading.Thread] = None
+
+    @contextmanager
+    def session(
+        self, session_id: Optional[str], on_wait: Optional[Callable[[int], None]] = None
+    ):
+        # Queries made within run for session_id, on_wait is called with the position in line
+        session_token = _current_session.set(session_id)
+        on_wait_token = _current_on_wait.set(on_wait)
+        try:
+            yield
+        finally:
+            _current_on_wait.reset(on_wait_token)
+            _current_session.reset(session_token)
+
+    def queue_position(self, session_id: str) -> Optional[int]:
+        # 1 for the next query admitted, None when the session is not waiting
+        with self._condition:
+            for position, ticket in enumerate(self._waiting, 1):
+                if ticket.session_id == session_id:
+                    return position
+        return None
+
+    def cancel(self, ticket: Ticket, reason: str):
+        with self._condition:
+            ticket.cancel(reason)
+            self._condition.notify_all()
+
+    def watch(self, session_id: str, on_gone: Callable[[str], None]):
+        # on_gone(session_id) is called once the session disconnects
+        with self._condition:
+            self._watched[session_id] = on_gone
+        self._start_watchdog()
+
+    @contextmanager
+    def admit(self):
+        """Wait for a slot, then run the query under its ticket.
+
+        Nested admissions (periods computed by the pool) share the ticket of the
+        query they are part of. Raises QueryCancelled if the ticket is cancelled while
+        waiting, leaving the block with an error cancels what is left of the query.
+        """
+        ticket = _current_ticket.get()
+        if ticket is not None:
+            ticket.check()
+            yield ticket
+            return
+
+        session_id = _current_session.get()
+        on_wait = _current_on_wait.get()
+        ticket = Ticket(session_id)
+        self._start_watchdog()
+        with self._condition:
+            previous = self._sessions.get(session_id) if session_id else None
+            if previous is not None:
+                # The session moved on, its previous query is not awaited anymore
+                previous.cancel("resubmitted")
+            if session_id:
+                self._sessions[session_id] = ticket
+            self._waiting.append(ticket)
+            self._condition.notify_all()
+
+        position = None
+        try:
+            while True:
+                with self._condition:
+                    if ticket.cancelled or (
+                        self._waiting[0] is ticket
+                        and len(self._running) < self.max_concurrent
+                    ):
+                        break
+                    waiting_position = self._waiting.index(ticket) + 1
+                    if waiting_position == position:
+                        self._condition.wait(WATCHDOG_INTERVAL_SECONDS)
+                        continue
+                # Reported out of the lock, on_wait draws on the page of the session
+                position = waiting_position
+                if on_wait is not None:
+                    on_wait(position)
+        except BaseException:
+            ticket.cancel("abandoned")
+            raise
+        finally:
+            with self._condition:
+                self._waiting.remove(ticket)
+                admitted = not ticket.cancelled
+                if admitted:
+                    ticket.admitted_at = time.monotonic()
+                    self._running.add(ticket)
+                else:
+                    self._release(ticket)
+                self._condition.notify_all()
+        if not admitted:
+            raise QueryCancelled(ticket.reason)
+
+        token = _current_ticket.set(ticket)
+        try:
+            yield ticket
+        except BaseException:
+            # Periods still running in the pool are interrupted
+            ticket.cancel("abandoned")
+            raise
+        finally:
+            _current_ticket.reset(token)
+            with self._condition:
+                self._running.discard(ticket)
+                self._release(ticket)
+                self._condition.notify_all()
+
+    def _release(self, ticket: Ticket):
+        if self._sessions.get(ticket.session_id) is ticket:
+            del self._sessions[ticket.session_id]
+
+    @contextmanager
+    def executing(self, cursor: duckdb.DuckDBPyConnection):
+        # The DuckDB queries run within on cursor are interrupted with the query
+        ticket = _current_ticket.get()
+        if ticket is None:
+            yield
+            return
+
+        with ticket._lock:
+            ticket.check()
+            ticket._cursors.add(cursor)
+        try:
+            yield
+        except duckdb.InterruptException:
+            raise QueryCancelled(ticket.reason or "abandoned")
+        except duckdb.OutOfMemoryException:
+            logging.warning("Query exceeded its memory budget")
+            raise QueryCancelled("memory")
+        finally:
+            with ticket._lock:
+                ticket._cursors.discard(cursor)
+
+    def _start_watchdog(self):
+        with self._condition:
+            if self._watchdog is None:
+                self._watchdog = threading.Thread(
+                    target=self._watch, name="query-governor", daemon=True
+                )
+                self._watchdog.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(WATCHDOG_INTERVAL_SECONDS)
+            try:
+                self._check()
+            except Exception:
+                logging.exception("Query governor check failed")
+
+    def _check(self):
+        now = time.monotonic()
+        gone = []
+        with self._condition:
+            tickets = list(self._running) + list(self._waiting)
+            watched = dict(self._watched)
+        for ticket in tickets:
+            if (
+                self.timeout_seconds
+                and ticket.admitted_at is not None
+                and now - ticket.admitted_at > self.timeout_seconds
+            ):
+                logging.warning(f"Query timed out after {self.timeout_seconds}s")
+                self.cancel(ticket, "timeout")
+            elif ticket.session_id and not self._is_alive(ticket.session_id):
+                self.cancel(ticket, "disconnected")
+        for session_id, on_gone in watched.items():
+            if not self._is_alive(session_id):
+                gone.append(session_id)
+                on_gone(session_id)
+        if gone:
+            with self._condition:
+                for session_id in gone:
+                    self._watched.pop(session_id, None)
+
+    def _is_alive(self, session_id: str) -> bool:
+        return self.session_alive is None or self.session_alive(session_id)
+
+
+governor = QueryGovernor(MAX_CONCURRENT_QUERIES, QUERY_TIMEOUT_SECONDS)
@@ -1,28 +1,38 @@
-import datetime
 from functools import lru_cache
 from typing import List
 
 import contextily
 import geopandas
 import pandas as pd
-import requests
 import streamlit as st
 
-from domain.query import get_average_speed_for
+from domain.calendar_dimension import get_calendar_table
+from domain.config import SNAPSHOT_DIRECTORY, SNAPSHOT_REFRESH_SECONDS
+from domain.pipeline import (
+    SpeedComputationMode,
+    count_column,
+    days_as_periods,
+    merge_periods,
+    sum_column,
+)
+from domain.query import (
+    get_average_speed_for,
+    get_average_speed_for_periods,
+    iter_average_speed_for_periods,
+)
+from domain.result_cache import result_cache
+from domain.segments import segment_index
+from domain.snapshots import Snapshot
+from domain.topology import Topology
 
 
-def auth_request(*args, **kwargs):
-    return requests.get(
-        *args,
-        **kwargs,
-        headers={
-            "Authorization": f"Bearer 42227799ae2e74ebc42ca66dee38f4352456c2e93a21962133e0056fd228392eecd70222df0a0c3882438acdfb59de933c50ef368cebb8f5ab8b19d3bd8d2134"
-        },
-    )
+def retrieve_stops_and_lines():
+    version, _ = stops_snapshot.table()
+    return _retrieve_stops_and_lines(version)
 
 
 @st.cache_data
-def retrieve_stops_and_lines():
+def _retrieve_stops_and_lines(stops_version: str):
     stops = get_stops()
     contextily.set_cache_dir("/tmp/")
     # Metro lines 1, 2, 3, 5 are not used in the analysis
@@ -39,10 +49,30 @@ def retrieve_stops_and_lines():
     return stops, line_ids
 
 
-@st.cache_data
+def get_topology() -> Topology:
+    version, _ = stops_snapshot.table()
+    return _get_topology(version)
+
+
+@st.cache_resource
+def _get_topology(stops_version: str) -> Topology:
+    # Shared by every session and never copied, unlike the cached dataframes
+    _, line_ids = _retrieve_stops_and_lines(stops_version)
+    return Topology(get_stops(), line_ids)
+
+
 def get_stops():
-    stops = auth_request("https://api.mobilitytwin.brussels/stib/stops").json()
-    stops_gdf = geopandas.GeoDataFrame.from_features(stops)
+    # Processed stops of the current snapshot, shared, it must not be modified
+    _, stops_gdf = stops_snapshot.table()
+    return stops_gdf
+
+
+# Bumped whenever build_stops changes the stops table
+STOPS_BUILD_VERSION = 1
+
+
+def build_stops(features: dict) -> geopandas.GeoDataFrame:
+    stops_gdf = geopandas.GeoDataFrame.from_features(features)
     # Sort stops_gdf by route_short_name, direction, stop_sequence
     stops_gdf.sort_values(
         by=["route_short_name", "direction", "stop_sequence"], inplace=True
@@ -70,18 +100,19 @@ def get_stops():
     return stops_gdf
 
 
-@st.cache_data
-def get_segments(line_id, direction_id: int):
-    shapefile = auth_request("https://api.mobilitytwin.brussels/stib/segments").json()
-    segments_gdf = geopandas.GeoDataFrame.from_features(shapefile)
-    segments_gdf = segments_gdf[
-        (segments_gdf["line_id"] == line_id)
-        & (segments_gdf["direction"] == direction_id + 1)
-    ]
-    # change direction column to be the map direction
-    segments_gdf["delta_distance"] = segments_gdf["distance"].diff()
+stops_snapshot = Snapshot(
+    "stops",
+    "/stib/stops",
+    build_stops,
+    STOPS_BUILD_VERSION,
+    SNAPSHOT_DIRECTORY,
+    SNAPSHOT_REFRESH_SECONDS,
+)
 
-    return segments_gdf
+
+def get_segments(line_id, direction_id: int):
+    # Slice of the network segment index, no download nor parsing per line
+    return segment_index().lookup(line_id, direction_id + 1)
 
 
 def remove_speed_outliers(results):
@@ -98,10 +129,8 @@ def remove_speed_outliers(results):
 
 @lru_cache(maxsize=1)
 def get_calendar_dates():
-    calendar_df = pd.read_csv("static/calendar.csv")[["CALENDAR_DATE", "DAY_TYPE"]]
-    calendar_df["CALENDAR_DATE"] = calendar_df["CALENDAR_DATE"].apply(
-        datetime.date.fromisoformat
-    )
+    calendar_df = get_calendar_table().copy()
+    calendar_df["CALENDAR_DATE"] = calendar_df["CALENDAR_DATE"].dt.date
     return calendar_df
 
 
@@ -113,10 +142,86 @@ def get_excluded_dates_as_period(day_types: List[str], start_date, end_date):
         & (calendar_df["CALENDAR_DATE"] <= end_date)
     ]
 
-    as_period = []
-    for index, row in excluded_dates.iterrows():
-        as_period.append((row["CALENDAR_DATE"], row["CALENDAR_DATE"]))
-    return as_period
+    # Consecutive days are merged, the query excludes them with a single anti-join anyway
+    return days_as_periods(excluded_dates["CALENDAR_DATE"])
+
+
+def speed_column(mode: SpeedComputationMode) -> str:
+    return f"speed_{mode.name.lower()}"
+
+
+def select_results_speed_computation_mode(results, speed_computation_mode):
+    # Results of build_results for every mode narrowed to the speed, count and time of one
+    speed = speed_column(speed_computation_mode)
+    count = count_column(speed_computation_mode)
+    results = results[results[count] > 0].rename(
+        columns={speed: "speed", count: "count"}
+    )
+    results = results.drop(
+        columns=[
+            column
+            for mode in SpeedComputationMode
+            if mode != speed_computation_mode
+            for column in (speed_column(mode), count_column(mode))
+        ]
+    )
+    results["time"] = results["delta_distance"] / (results["speed"] / 3.6)
+    return results
+
+
+ALL_DAYS_HUMAN_INDEX = [1, 2, 3, 4, 5, 6, 7]
+
+
+def slice_results(
+    results, selected_days_human_index, start_hour, end_hour, excluded_periods
+):
+    # Rows of build_results within narrower hours, days and exclusions
+    excluded_days = {
+        day for start, end in excluded_periods for day in pd.date_range(start, end).date
+    }
+    return results[
+        (results["local_hour"] >= start_hour)
+        & (results["local_hour"] <= end_hour)
+        & results["local_dow"].isin(selected_days_human_index)
+        & ~results["date"].dt.date.isin(excluded_days)
+    ].copy()
+
+
+def normalize_query(
+    line_name,
+    direction_id,
+    selected_days_human_index,
+    start_hour,
+    end_hour,
+    start_date,
+    end_date,
+    start_stop_index,
+    end_stop_index,
+    excluded_periods,
+    periods,
+    superset,
+):
+    # Days, hours and exclusions to query and the result cache key they are stored under
+    if superset:
+        query = (ALL_DAYS_HUMAN_INDEX, 0, 23, [])
+    else:
+        query = (selected_days_human_index, start_hour, end_hour, excluded_periods)
+    query_days, query_start_hour, query_end_hour, query_excluded_periods = query
+    # Results hold every mode so the mode is not part of the key
+    key = (
+        line_name,
+        direction_id,
+        tuple(sorted(set(query_days))),
+        query_start_hour,
+        query_end_hour,
+        start_date,
+        end_date,
+        start_stop_index,
+        end_stop_index,
+        tuple(merge_periods(query_excluded_periods)),
+        None if periods is None else tuple(periods),
+    )
+    return query, key
 
 
 def build_results(
@@ -132,11 +237,224 @@ def build_results(
     end_stop_index,
     excluded_periods,
     speed_computation_mode,
+    periods=None,
+    superset=False,
+    progress=None,
+):
+    # When periods is given, all of them are computed at once (start_date and end_date are
+    # ignored) and the results are tagged with a period column, progress is then called with
+    # (done, total) as the disjoint periods complete. Every speed computation mode
+    # comes out of the same scan, without mode the results keep a speed and count column per
+    # mode to be narrowed with select_results_speed_computation_mode.
+    # With superset, every hour of every day of the dates is computed (and cached) once, the
+    # hours, days and exclusions are then sliced out of it in memory. Speeds at the edges of
+    # the selection may differ slightly as their previous point is no longer filtered out
+    if periods is not None:
+        start_date, end_date = None, None
+    query, key = normalize_query(
+        line_name,
+        direction_id,
+        selected_days_human_index,
+        start_hour,
+        end_hour,
+        start_date,
+        end_date,
+        start_stop_index,
+        end_stop_index,
+        excluded_periods,
+        periods,
+        superset,
+    )
+    query_days, query_start_hour, query_end_hour, query_excluded_periods = query
+    results = result_cache.get_or_compute(
+        key,
+        lambda: compute_results(
+            stops,
+            line_name,
+            direction_id,
+            query_days,
+            query_start_hour,
+            query_end_hour,
+            start_date,
+            end_date,
+            start_stop_index,
+            end_stop_index,
+            query_excluded_periods,
+            periods,
+            progress,
+        ),
+    )
+    return finish_results(
+        results,
+        selected_days_human_index,
+        start_hour,
+        end_hour,
+        excluded_periods,
+        speed_computation_mode,
+        superset,
+    )
+
+
+def finish_results(
+    results,
+    selected_days_human_index,
+    start_hour,
+    end_hour,
+    excluded_periods,
+    speed_computation_mode,
+    superset,
 ):
-    all_stops = get_stops()
+    # From the results of compute_results for the normalized query to the requested ones
+    if superset:
+        results = slice_results(
+            results, selected_days_human_index, start_hour, end_hour, excluded_periods
+        )
+
+    if speed_computation_mode is None:
+        return results
+    return select_results_speed_computation_mode(results, speed_computation_mode)
 
-    all_stops.to_csv("all_stops.csv", index=False)
 
+def iter_build_results(
+    stops,
+    line_name,
+    direction_id,
+    selected_days_human_index,
+    start_hour,
+    end_hour,
+    start_stop_index,
+    end_stop_index,
+    excluded_periods,
+    periods,
+    superset=False,
+):
+    # Approximate build_results (every mode, tagged with periods) on a growing sample of the
+    # days, see iter_average_speed_for_periods. Yields (fraction of the days, results), the
+    # last results are exact and cached like the ones of build_results
+    query, key = normalize_query(
+        line_name,
+        direction_id,
+        selected_days_human_index,
+        start_hour,
+        end_hour,
+        None,
+        None,
+        start_stop_index,
+        end_stop_index,
+        excluded_periods,
+        periods,
+        superset,
+    )
+    query_days, query_start_hour, query_end_hour, query_excluded_periods = query
+
+    results = result_cache.get(key)
+    if results is None:
+        selected_stops, stop_ids = _select_stops(
+            stops, line_name, direction_id, start_stop_index, end_stop_index
+        )
+        for fraction, results in iter_average_speed_for_periods(
+            line_name,
+            stop_ids,
+            periods,
+            query_excluded_periods,
+            query_days,
+            query_start_hour,
+            query_end_hour,
+        ):
+            results = _assemble_results(selected_stops, results)
+            if fraction == 1:
+                break
+            if superset:
+                results = slice_results(
+                    results,
+                    selected_days_human_index,
+                    start_hour,
+                    end_hour,
+                    excluded_periods,
+                )
+            yield fraction, results
+        result_cache.put(key, results)
+
+    results = results.copy()
+    if superset:
+        results = slice_results(
+            results, selected_days_human_index, start_hour, end_hour, excluded_periods
+        )
+    yield 1.0, results
+
+
+def speed_confidence_intervals(results, confidence_z=1.96):
+    # Per segment (and period) average of the daily average speeds of results narrowed to
+    # one mode, with the half width of its confidence interval over the sampled days
+    keys = ["stop_sequence", "prev_stop_name", "stop_name", "segment"]
+    if "period" in results.columns:
+        keys.append("period")
+    daily = (
+        results.assign(day=results["date"].dt.date)
+        .groupby(keys + ["day"], observed=True)["speed"]
+        .mean()
+        .reset_index()
+    )
+    intervals = (
+        daily.groupby(keys, observed=True)["speed"]
+        .agg(["mean", "std", "count"])
+        .reset_index()
+    )
+    intervals["speed_ci"] = (
+        confidence_z * intervals["std"].fillna(0) / intervals["count"] ** 0.5
+    )
+    return intervals.rename(columns={"mean": "speed", "count": "days"}).drop(
+        columns=["std"]
+    )
+
+
+def compute_results(
+    stops,
+    line_name,
+    direction_id,
+    selected_days_human_index,
+    start_hour,
+    end_hour,
+    start_date,
+    end_date,
+    start_stop_index,
+    end_stop_index,
+    excluded_periods,
+    periods,
+    progress=None,
+):
+    selected_stops, stop_ids = _select_stops(
+        stops, line_name, direction_id, start_stop_index, end_stop_index
+    )
+
+    if periods is None:
+        results = get_average_speed_for(
+            line_name,
+            stop_ids,
+            start_date,
+            end_date,
+            excluded_periods,
+            selected_days_human_index,
+            start_hour,
+            end_hour,
+            speed_computation_mode=None,
+        )
+    else:
+        results = get_average_speed_for_periods(
+            line_name,
+            stop_ids,
+            periods,
+            excluded_periods,
+            selected_days_human_index,
+            start_hour,
+            end_hour,
+            speed_computation_mode=None,
+            progress=progress,
+        )
+    return _assemble_results(selected_stops, results)
+
+
+def _select_stops(stops, line_name, direction_id, start_stop_index, end_stop_index):
     segments = get_segments(line_name, direction_id)
     # drop direction column
     segments = segments.drop(columns=["direction"])
@@ -155,62 +473,59 @@ def build_results(
     selected_stops = stops.loc[start_stop_index : end_stop_index + 1]
 
     stop_ids = [str(row["prev_stop_id"]) for index, row in selected_stops.iterrows()]
+    return selected_stops, stop_ids
 
-    selected_period = [start_date, end_date]
-
-    results = get_average_speed_for(
-        line_name,
-        stop_ids,
-        selected_period[0],
-        selected_period[1],
-        excluded_periods,
-        selected_days_human_index,
-        start_hour,
-        end_hour,
-        speed_computation_mode=speed_computation_mode,
-    )
-    # Convert pointId to integer
-    results["pointId"] = results["pointId"].astype(int)
 
-    results = selected_stops.merge(
-        results, left_on="prev_stop_id", right_index=True, how="right"
+def aggregate_results(selected_stops, results):
+    # Per mode speed and count of every (point, bucket[, period]), the directions of
+    # a point are merged. Aggregated on the integer keys of the results, the stop
+    # attributes and geometries are only attached to the aggregated rows
+    for mode in SpeedComputationMode:
+        results[speed_column(mode)] = (
+            results[sum_column(mode)] / results[count_column(mode)] * 3.6
+        )
+    results = results.drop(columns=[sum_column(mode) for mode in SpeedComputationMode])
+
+    aggregations = {}
+    for mode in SpeedComputationMode:
+        aggregations[count_column(mode)] = "sum"
+        aggregations[speed_column(mode)] = "mean"
+    aggregations["directionId"] = "first"
+    keys = [column for column in results.columns if column not in aggregations]
+
+    results = results.groupby(keys, observed=True).agg(aggregations).reset_index()
+    return selected_stops.merge(results, left_on="prev_stop_id", right_on="pointId")
+
+
+def categorize_strings(df):
+    # Text columns as categories, each row holds an integer code instead of a string
+    return df.astype(
+        {
+            column: "category"
+            for column in df.columns
+            if df[column].dtype == object and pd.api.types.is_string_dtype(df[column])
+        }
     )
 
-    cached = {}
-
-    def get_stop_name(stop_id):
-        original_stop_id = stop_id
-        if original_stop_id not in cached:
-            if isinstance(stop_id, str):
-                stop_id = int(stop_id)
-            try:
-                cached[original_stop_id] = all_stops[all_stops["stop_id"] == stop_id][
-                    "stop_name"
-                ].values[0]
-            except IndexError:
-                cached[original_stop_id] = f"Stop ID {stop_id}"
-        return cached[original_stop_id]
 
-    group_by_cols = results.columns[
-        ~results.columns.isin(["count", "speed", "directionId"])
-    ]
+def _assemble_results(selected_stops, results):
+    topology = get_topology()
 
-    results = (
-        results.reset_index()
-        .groupby(list(group_by_cols))
-        .agg(
-            {
-                "count": "sum",
-                "speed": "mean",
-                "directionId": "first",
-            }
-        )
-        .reset_index()
+    # Names are resolved on the few selected stops, the merge then only repeats the
+    # category codes on the rows of the results
+    selected_stops = selected_stops.assign(
+        prev_stop_name=selected_stops["prev_stop_id"].map(topology.stop_name)
     )
-
-    results["direction_stop_name"] = results["directionId"].apply(get_stop_name)
-    results["prev_stop_name"] = results["prev_stop_id"].apply(get_stop_name)
-    results["time"] = results["delta_distance"] / (results["speed"] / 3.6)
-    # Group by prev_stop_name and direction_stop_name
+    selected_stops["segment"] = (
+        selected_stops["prev_stop_name"] + " -> " + selected_stops["stop_name"]
+    )
+    results = aggregate_results(categorize_strings(selected_stops), results)
+
+    results["direction_stop_name"] = (
+        results["directionId"].astype("category").map(topology.stop_name)
+    ).astype("category")
+    # Bucket local hour and day of the week (1 is monday), see slice_results
+    results["local_hour"] = results["date"].dt.hour.astype("int8")
+    results["local_dow"] = (results["date"].dt.dayofweek + 1).astype("int8")
 
     return results
@@ -0,0 +1,61 @@
+import pickle
+
+import geopandas
+import pandas as pd
+import pyarrow as pa
+from shapely.geometry.base import BaseGeometry
+
+# Schema metadata listing the columns that do not map to an Arrow type as is
+GEOMETRY_COLUMNS_KEY = b"geometry_columns"
+PICKLED_COLUMNS_KEY = b"pickled_columns"
+
+
+def results_to_ipc(results: pd.DataFrame) -> bytes:
+    # Shapely geometries travel as dictionary encoded WKB (a segment is repeated on
+    # every bucket), columns Arrow cannot type (mixed objects) are pickled. Categorical
+    # columns travel as Arrow dictionaries and come back as categoricals
+    columns = {}
+    geometry_columns, pickled_columns = [], []
+    for column in results.columns:
+        values = results[column]
+        first = values.dropna().iloc[0] if values.notna().any() else None
+        if isinstance(first, BaseGeometry):
+            columns[column] = pa.array(
+                geopandas.GeoSeries(values).to_wkb()
+            ).dictionary_encode()
+            geometry_columns.append(column)
+            continue
+        try:
+            columns[column] = pa.array(values, from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            columns[column] = pa.array([pickle.dumps(value) for value in values])
+            pickled_columns.append(column)
+
+    table = pa.table(columns).replace_schema_metadata(
+        {
+            GEOMETRY_COLUMNS_KEY: ",".join(geometry_columns),
+            PICKLED_COLUMNS_KEY: ",".join(pickled_columns),
+        }
+    )
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def results_from_ipc(data: bytes) -> pd.DataFrame:
+    table = pa.ipc.open_stream(data).read_all()
+    metadata = table.schema.metadata or {}
+    results = table.to_pandas()
+    for column in _metadata_columns(metadata, GEOMETRY_COLUMNS_KEY):
+        # Each distinct geometry is decoded once and shared by its rows
+        wkb = results[column].cat
+        geometries = geopandas.GeoSeries.from_wkb(wkb.categories).values
+        results[column] = geometries.take(wkb.codes, allow_fill=True)
+    for column in _metadata_columns(metadata, PICKLED_COLUMNS_KEY):
+        results[column] = [pickle.loads(value) for value in results[column]]
+    return results
+
+
+def _metadata_columns(metadata, key: bytes):
+    return [column for column in metadata.get(key, b"").decode().split(",") if column]
@@ -0,0 +1,291 @@
+import itertools
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+import pandas as pd
+
+from domain.config import DUCKDB_THREADS, JOB_WORKERS, QUERY_MEMORY_BUDGET_BYTES
+from domain.governor import QueryCancelled, governor
+from domain.helpers import compute_results, finish_results, normalize_query
+from domain.ipc import results_from_ipc, results_to_ipc
+from domain.result_cache import result_cache
+
+# Latest cancelled job ids shared with the workers, a running job is interrupted when its
+# id shows up
+CANCELLED_JOBS_SLOTS = 64
+
+
+def _init_worker(duckdb_threads: int, cancelled_jobs):
+    # The cores are split between the workers, each has its own DuckDB database and runs
+    # a single job at a time within one memory budget
+    from domain.database import database
+
+    database.config["threads"] = duckdb_threads
+    if QUERY_MEMORY_BUDGET_BYTES:
+        database.config["memory_limit"] = f"{QUERY_MEMORY_BUDGET_BYTES}B"
+    # In a worker the session of a query is its job, gone once cancelled by the server
+    governor.session_alive = lambda job_id: int(job_id) not in cancelled_jobs[:]
+    logging.basicConfig(level=logging.INFO)
+
+
+def _run_job(job_id: int, *args) -> bytes:
+    with governor.session(str(job_id)):
+        return results_to_ipc(compute_results(*args))
+
+
+class Job:
+    """Handle on an analysis computed by the worker processes, pages poll it.
+
+    ``result`` gives the results like build_results would, the computed (unfiltered,
+    every mode) results are stored in the result cache for the following queries.
+    """
+
+    def __init__(
+        self,
+        future: Future,
+        finish_args: tuple,
+        process_future: Optional[Future] = None,
+        job_id: Optional[int] = None,
+    ):
+        self.future = future
+        self.finish_args = finish_args
+        self.process_future = process_future
+        self.job_id = job_id
+        self.submitted_at = time.monotonic()
+
+    @property
+    def status(self) -> str:
+        if self.future.done():
+            return "failed" if self.future.exception() is not None else "done"
+        if self.process_future is not None and self.process_future.running():
+            return "running"
+        return "queued"
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.submitted_at
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def result(self, speed_computation_mode=None) -> pd.DataFrame:
+        (
+            selected_days_human_index,
+            start_hour,
+            end_hour,
+            excluded_periods,
+            superset,
+        ) = self.finish_args
+        return finish_results(
+            self.future.result().copy(),
+            selected_days_human_index,
+            start_hour,
+            end_hour,
+            excluded_periods,
+            speed_computation_mode,
+            superset,
+        )
+
+
+class JobRunner:
+    """Pool of worker processes running compute_results out of the Streamlit server.
+
+    The processes are spawned on the first job. Identical jobs submitted while one is
+    running share it, results travel back as Arrow IPC and are decoded in a thread of
+    the server, not in the script thread of the session. A job no session waits for
+    anymore (resubmitted or disconnected) is dropped from the queue or interrupted.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._cancelled_jobs = None
+        self._cancelled_count = 0
+        self._job_ids = itertools.count(1)
+        # Key of the normalized query -> (future of the results, future of the worker, job id)
+        self._running = {}
+        # Sessions waiting for each running key and the key each session waits for
+        self._subscribers = {}
+        self._session_keys = {}
+        # Reentrant, the done callback runs in place when the worker is already done
+        self._lock = threading.RLock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # Spawned, forking the threads of the server (and of DuckDB) is not safe
+            context = multiprocessing.get_context("spawn")
+            self._cancelled_jobs = context.Array("q", CANCELLED_JOBS_SLOTS)
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(
+                    max(1, DUCKDB_THREADS // self.workers),
+                    self._cancelled_jobs,
+                ),
+            )
+        return self._pool
+
+    def _submit(self, key, args) -> tuple[Future, Future, int]:
+        future = Future()
+        job_id = next(self._job_ids)
+        try:
+            process_future = self._get_pool().submit(_run_job, job_id, *args)
+        except BrokenProcessPool:
+            # A worker died (out of memory, ...), start over with a new pool
+            self._pool = None
+            process_future = self._get_pool().submit(_run_job, job_id, *args)
+        future.set_running_or_notify_cancel()
+        self._running[key] = (future, process_future, job_id)
+
+        def on_done(done: Future):
+            with self._lock:
+                if self._running.get(key, (None, done))[1] is done:
+                    self._running.pop(key, None)
+                    self._subscribers.pop(key, None)
+            try:
+                results = results_from_ipc(done.result())
+            except CancelledError:
+                future.set_exception(QueryCancelled("abandoned"))
+                return
+            except BaseException as e:
+                future.set_exception(e)
+                return
+            result_cache.put(key, results)
+            future.set_result(results)
+
+        process_future.add_done_callback(on_done)
+        return future, process_future, job_id
+
+    def _follow(self, session_id: str, key):
+        # session_id now waits for key, the job it waited for before is cancelled if orphaned
+        previous_key = self._session_keys.get(session_id)
+        self._session_keys[session_id] = key
+        self._subscribers.setdefault(key, set()).add(session_id)
+        if previous_key is not None and previous_key != key:
+            self._unsubscribe(session_id, previous_key)
+
+    def _unsubscribe(self, session_id: str, key):
+        subscribers = self._subscribers.get(key)
+        if subscribers is None:
+            return
+        subscribers.discard(session_id)
+        if subscribers:
+            return
+        del self._subscribers[key]
+        running = self._running.pop(key, None)
+        if running is None:
+            return
+        _, process_future, job_id = running
+        if not process_future.cancel():
+            # Already in a worker, its governor interrupts the job
+            self._cancelled_jobs[self._cancelled_count % CANCELLED_JOBS_SLOTS] = job_id
+            self._cancelled_count += 1
+        logging.info(f"Job {job_id} cancelled, no session is waiting for it")
+
+    def cancel_session(self, session_id: str):
+        with self._lock:
+            key = self._session_keys.pop(session_id, None)
+            if key is not None:
+                self._unsubscribe(session_id, key)
+
+    def queue_position(self, job: Job) -> Optional[int]:
+        # Position of a queued job among the jobs not started yet, None otherwise
+        with self._lock:
+            position = 0
+            for _, process_future, job_id in self._running.values():
+                if process_future.running() or process_future.done():
+                    continue
+                position += 1
+                if job_id == job.job_id:
+                    return position
+        return None
+
+    def submit(
+        self,
+        stops,
+        line_name,
+        direction_id,
+        selected_days_human_index,
+        start_hour,
+        end_hour,
+        start_date,
+        end_date,
+        start_stop_index,
+        end_stop_index,
+        excluded_periods,
+        periods=None,
+        superset=False,
+        session_id: Optional[str] = None,
+    ) -> Job:
+        # Same arguments as build_results, the mode is selected when getting the result.
+        # The job of the previous submission of session_id is cancelled if nobody else waits for it
+        if periods is not None:
+            start_date, end_date = None, None
+        query, key = normalize_query(
+            line_name,
+            direction_id,
+            selected_days_human_index,
+            start_hour,
+            end_hour,
+            start_date,
+            end_date,
+            start_stop_index,
+            end_stop_index,
+            excluded_periods,
+            periods,
+            superset,
+        )
+        query_days, query_start_hour, query_end_hour, query_excluded_periods = query
+        finish_args = (
+            selected_days_human_index,
+            start_hour,
+            end_hour,
+            excluded_periods,
+            superset,
+        )
+
+        with self._lock:
+            results = result_cache.get(key)
+            if results is not None:
+                if session_id is not None:
+                    self.cancel_session(session_id)
+                future = Future()
+                future.set_result(results)
+                return Job(future, finish_args)
+            running = self._running.get(key)
+            if running is None:
+                running = self._submit(
+                    key,
+                    (
+                        stops,
+                        line_name,
+                        direction_id,
+                        query_days,
+                        query_start_hour,
+                        query_end_hour,
+                        start_date,
+                        end_date,
+                        start_stop_index,
+                        end_stop_index,
+                        query_excluded_periods,
+                        periods,
+                    ),
+                )
+            future, process_future, job_id = running
+            if session_id is not None:
+                self._follow(session_id, key)
+                governor.watch(session_id, self.cancel_session)
+            return Job(future, finish_args, process_future, job_id)
+
+
+job_runner = JobRunner(JOB_WORKERS)
@@ -0,0 +1,158 @@
+import bisect
+import logging
+import os
+import tempfile
+import threading
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional
+
+import duckdb
+import pandas as pd
+
+from domain.config import MANIFEST_PATH
+from domain.database import database
+from domain.parquet_cache import parquet_cache, url_key
+
+# Number of files whose footers are read by a single parquet_metadata query
+INSPECTION_BATCH_SIZE = 256
+
+
+class ManifestEntry(NamedTuple):
+    min_date: Optional[datetime]
+    max_date: Optional[datetime]
+    row_count: int
+    min_line: Optional[str]
+    max_line: Optional[str]
+
+    def contains_line(self, line_id: str) -> bool:
+        if self.min_line is None or self.max_line is None:
+            return True
+        return self.min_line <= line_id <= self.max_line
+
+    def overlaps(
+        self, intervals: List[tuple[datetime, datetime]], ends: List[datetime]
+    ) -> bool:
+        # intervals are sorted, disjoint UTC [from, to) intervals, ends their ends
+        if self.min_date is None or self.max_date is None:
+            return True
+        i = bisect.bisect_right(ends, self.min_date)
+        return i < len(intervals) and intervals[i][0] <= self.max_date
+
+
+class Manifest:
+    """Index of the parquetized files: UTC time coverage, row count and lines.
+
+    Entries are built from the parquet footers (statistics of the date and lineId
+    columns) the first time a file is seen and persisted, so that files which cannot
+    match a query are never downloaded.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._entries: Optional[Dict[str, ManifestEntry]] = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, ManifestEntry]:
+        if not os.path.exists(self.path):
+            return {}
+        manifest_df = pd.read_parquet(self.path)
+        return {
+            row.key: ManifestEntry(
+                None if pd.isna(row.min_date) else row.min_date.to_pydatetime(),
+                None if pd.isna(row.max_date) else row.max_date.to_pydatetime(),
+                int(row.row_count),
+                row.min_line,
+                row.max_line,
+            )
+            for row in manifest_df.itertuples(index=False)
+        }
+
+    def _save(self):
+        # Entries written meanwhile by another process are kept
+        entries = {**self._load(), **self._entries}
+        manifest_df = pd.DataFrame(
+            [(key, *entry) for key, entry in entries.items()],
+            columns=["key", *ManifestEntry._fields],
+        )
+        manifest_df["min_date"] = pd.to_datetime(manifest_df["min_date"])
+        manifest_df["max_date"] = pd.to_datetime(manifest_df["max_date"])
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix=".tmp")
+        os.close(fd)
+        manifest_df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, self.path)
+
+    def _inspect(self, urls: List[str]) -> Dict[str, ManifestEntry]:
+        # Only the footers are read, from the local copy when there is one
+        sources = {parquet_cache.lookup(url) or url: url for url in urls}
+        files = ",".join(map(lambda x: f"'{x}'", sources))
+        rows = (
+            database.cursor()
+            .execute(
+                f"""SELECT
+                file_name,
+                min(TRY_CAST(stats_min_value AS TIMESTAMP)) FILTER (WHERE path_in_schema = 'date'),
+                max(TRY_CAST(stats_max_value AS TIMESTAMP)) FILTER (WHERE path_in_schema = 'date'),
+                sum(row_group_num_rows) FILTER (WHERE path_in_schema = 'date'),
+                min(stats_min_value) FILTER (WHERE path_in_schema = 'lineId'),
+                max(stats_max_value) FILTER (WHERE path_in_schema = 'lineId')
+            FROM parquet_metadata([{files}])
+            GROUP BY file_name
+            """
+            )
+            .fetchall()
+        )
+        return {
+            url_key(sources[file_name]): ManifestEntry(
+                min_date, max_date, int(row_count or 0), min_line, max_line
+            )
+            for file_name, min_date, max_date, row_count, min_line, max_line in rows
+        }
+
+    def update(self, urls: List[str]):
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+            unknown = [url for url in urls if url_key(url) not in self._entries]
+        if not unknown:
+            return
+
+        # Footers are read without the lock, concurrent queries on known files are not
+        # held up by the network. Files inspected twice meanwhile get the same entry
+        inspected = {}
+        for i in range(0, len(unknown), INSPECTION_BATCH_SIZE):
+            try:
+                inspected.update(self._inspect(unknown[i : i + INSPECTION_BATCH_SIZE]))
+            except duckdb.Error as e:
+                # Not indexed files are simply never pruned
+                logging.warning(f"Could not index parquet files: {e}")
+        if not inspected:
+            return
+
+        with self._lock:
+            self._entries.update(inspected)
+            self._save()
+
+    def prune(
+        self, urls: List[str], line_id: str, intervals: List[tuple[datetime, datetime]]
+    ) -> List[str]:
+        # Files that may hold points of the line within the UTC intervals
+        self.update(urls)
+        ends = [end for _, end in intervals]
+        kept = []
+        skipped_rows = 0
+        for url in urls:
+            entry = self._entries.get(url_key(url))
+            if entry is None or (
+                entry.contains_line(line_id) and entry.overlaps(intervals, ends)
+            ):
+                kept.append(url)
+            else:
+                skipped_rows += entry.row_count
+        logging.info(
+            f"Manifest: {len(kept)} of {len(urls)} files kept, {skipped_rows} rows skipped"
+        )
+        return kept
+
+
+manifest = Manifest(MANIFEST_PATH)
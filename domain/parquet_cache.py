@@ -0,0 +1,225 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from urllib.parse import urlsplit
+
+from domain.api import api
+from domain.config import (
+    PARQUET_CACHE_DIRECTORY,
+    PARQUET_CACHE_DOWNLOAD_WORKERS,
+    PARQUET_CACHE_GRACE_SECONDS,
+    PARQUET_CACHE_MAX_BYTES,
+)
+
+CHUNK_SIZE = 1024 * 1024
+# The size index is rebuilt from the directory after this long, other processes
+# (job workers) share the cache
+INDEX_RESCAN_SECONDS = 300
+
+
+def url_key(url: str) -> str:
+    # Signed urls carry a query string that changes on every call, the path identifies the file
+    parts = urlsplit(url)
+    return hashlib.sha256(f"{parts.netloc}{parts.path}".encode("utf-8")).hexdigest()
+
+
+class ParquetCache:
+    """Content-addressed local copy of remote parquet files with LRU eviction.
+
+    Files are stored once under ``objects/<sha256 of content>.parquet``, ``refs/``
+    maps each remote url to the digest of its content. The modification time of an
+    object is bumped on every use and is what the eviction orders on, objects used
+    within ``grace_seconds`` are kept even over budget as a query may be about to
+    open them. Sizes are tracked in an index kept up to date by this process and
+    rebuilt from the directory every ``INDEX_RESCAN_SECONDS``.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int,
+        download_workers: int = 8,
+        grace_seconds: int = PARQUET_CACHE_GRACE_SECONDS,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.download_workers = download_workers
+        self.grace_seconds = grace_seconds
+        self.objects_directory = os.path.join(directory, "objects")
+        self.refs_directory = os.path.join(directory, "refs")
+        # Object path -> [last use, size]
+        self._index = {}
+        self._total = 0
+        self._indexed_at = None
+        self._lock = threading.Lock()
+
+        if self.enabled:
+            os.makedirs(self.objects_directory, exist_ok=True)
+            os.makedirs(self.refs_directory, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_directory, f"{digest}.parquet")
+
+    def _ref_path(self, url: str) -> str:
+        return os.path.join(self.refs_directory, url_key(url))
+
+    def lookup(self, url: str) -> Optional[str]:
+        # Local path of url if cached, None otherwise
+        ref_path = self._ref_path(url)
+        try:
+            with open(ref_path) as ref:
+                path = self._object_path(ref.read().strip())
+        except FileNotFoundError:
+            return None
+        try:
+            # Mark as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            # The object was evicted, the ref is dangling
+            self._remove(ref_path)
+            return None
+        self._touch(path)
+        return path
+
+    def _touch(self, path: str, size: Optional[int] = None):
+        with self._lock:
+            entry = self._index.get(path)
+            if entry is not None:
+                entry[0] = time.time()
+            elif size is not None:
+                self._index[path] = [time.time(), size]
+                self._total += size
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _download(self, url: str) -> str:
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.objects_directory, suffix=".tmp")
+        try:
+            # Pooled connections, the signed urls of the files do not get the API token
+            with os.fdopen(fd, "wb") as tmp, api.get(url, stream=True) as response:
+                response.raise_for_status()
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    digest.update(chunk)
+                    tmp.write(chunk)
+            path = self._object_path(digest.hexdigest())
+            size = os.path.getsize(tmp_path)
+            # Replacing is atomic, concurrent downloads of the same content are harmless
+            os.replace(tmp_path, path)
+            self._touch(path, size)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        fd, tmp_ref = tempfile.mkstemp(dir=self.refs_directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as ref:
+            ref.write(digest.hexdigest())
+        os.replace(tmp_ref, self._ref_path(url))
+        return path
+
+    def localize(self, urls: List[str]) -> List[str]:
+        """Return local paths for ``urls``, downloading the files not cached yet."""
+        if not self.enabled:
+            return list(urls)
+
+        paths = [self.lookup(url) for url in urls]
+        missing = [i for i, path in enumerate(paths) if path is None]
+
+        if missing:
+            logging.info(
+                f"Parquet cache: {len(urls) - len(missing)} hits, {len(missing)} downloads"
+            )
+            with ThreadPoolExecutor(max_workers=self.download_workers) as pool:
+                downloaded = pool.map(self._download, [urls[i] for i in missing])
+                for i, path in zip(missing, downloaded):
+                    paths[i] = path
+
+        self.evict(protected=set(paths))
+        return paths
+
+    def evict(self, protected=frozenset()):
+        """Remove least recently used files until the cache fits its byte budget."""
+        with self._lock:
+            if (
+                self._indexed_at is None
+                or time.monotonic() - self._indexed_at > INDEX_RESCAN_SECONDS
+            ):
+                self._rescan()
+            if self._total <= self.max_bytes:
+                return
+
+            recent = time.time() - self.grace_seconds
+            evicted = set()
+            for path, (used_at, size) in sorted(
+                self._index.items(), key=lambda item: item[1][0]
+            ):
+                if used_at > recent:
+                    # Everything left was used within the grace period
+                    break
+                if path in protected:
+                    continue
+                self._remove(path)
+                evicted.add(path)
+                self._total -= size
+                if self._total <= self.max_bytes:
+                    break
+            for path in evicted:
+                del self._index[path]
+
+        if evicted:
+            self._prune_refs(evicted)
+
+    def _rescan(self):
+        # Called with the lock held, sizes and last uses as on disk
+        self._index, self._total = {}, 0
+        with os.scandir(self.objects_directory) as it:
+            for entry in it:
+                if not entry.name.endswith(".parquet"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                self._index[entry.path] = [stat.st_mtime, stat.st_size]
+                self._total += stat.st_size
+        self._indexed_at = time.monotonic()
+        # Refs left dangling by evictions of other processes
+        self._prune_refs(None)
+
+    def _prune_refs(self, evicted_paths):
+        # Refs pointing to one of evicted_paths, or to any missing object when None
+        with os.scandir(self.refs_directory) as it:
+            for entry in it:
+                if entry.name.endswith(".tmp"):
+                    continue
+                try:
+                    with open(entry.path) as ref:
+                        path = self._object_path(ref.read().strip())
+                except FileNotFoundError:
+                    continue
+                if (
+                    path in evicted_paths
+                    if evicted_paths is not None
+                    else not os.path.exists(path)
+                ):
+                    self._remove(entry.path)
+
+
+parquet_cache = ParquetCache(
+    PARQUET_CACHE_DIRECTORY, PARQUET_CACHE_MAX_BYTES, PARQUET_CACHE_DOWNLOAD_WORKERS
+)
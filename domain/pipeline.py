@@ -0,0 +1,231 @@
+from datetime import date, datetime, timedelta
+from enum import Enum
+from typing import List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from domain.manifest import manifest
+from domain.parquet_cache import parquet_cache
+from domain.planner import plan_utc_intervals, utc_bounds_filter_sql
+from domain.sources import list_parquet_files
+from domain.warehouse import warehouse_files_for
+
+
+class SpeedComputationMode(Enum):
+    GREATER_THAN_ZERO = 1
+    GREATER_THAN_ZERO_IF_CLOSE_TO_STOP = 2
+    ALL = 3
+
+
+MAPPING_SPEED_COMPUTATION_MODE = {
+    SpeedComputationMode.GREATER_THAN_ZERO: "speed > 0",
+    SpeedComputationMode.GREATER_THAN_ZERO_IF_CLOSE_TO_STOP: "distanceFromPoint > 50 or speed > 0",
+    SpeedComputationMode.ALL: "speed >= 0",
+}
+
+
+def sum_column(mode: SpeedComputationMode) -> str:
+    return f"speed_sum_{mode.name.lower()}"
+
+
+def count_column(mode: SpeedComputationMode) -> str:
+    return f"count_{mode.name.lower()}"
+
+
+# Result columns of the per mode aggregates, speeds are summed in m/s
+BY_MODE_COLUMNS = ["lineId", "directionId", "pointId", "date"] + [
+    column
+    for mode in SpeedComputationMode
+    for column in (sum_column(mode), count_column(mode))
+]
+
+
+def by_mode_frame(table: pa.Table) -> pd.DataFrame:
+    # Compact frame of an Arrow table with the BY_MODE_COLUMNS (in that order): point
+    # and direction ids as 32 bits integers, the line dictionary encoded (categorical),
+    # 32 bits counts. Converted from the Arrow buffers, no Python string per row
+    integer_columns = {"directionId", "pointId"} | {
+        count_column(mode) for mode in SpeedComputationMode
+    }
+    columns = {}
+    for name, column in zip(BY_MODE_COLUMNS, table.columns):
+        if name == "lineId":
+            column = column.dictionary_encode()
+        elif name in integer_columns:
+            column = pc.cast(column, pa.int32())
+        columns[name] = column
+    return pa.table(columns).to_pandas()
+
+
+def mode_aggregates_sql() -> str:
+    # Sums and counts are mergeable, one pair per speed computation mode out of a single scan
+    return ",\n".join(
+        f"sum(speed) FILTER (WHERE {condition}) AS {sum_column(mode)}, "
+        f"count(*) FILTER (WHERE {condition}) AS {count_column(mode)}"
+        for mode, condition in MAPPING_SPEED_COMPUTATION_MODE.items()
+    )
+
+
+EMPTY_ENTRIES_SQL = """
+        SELECT NULL::VARCHAR as lineId, NULL::VARCHAR as pointId, NULL::VARCHAR as directionId,
+        NULL::DOUBLE as distanceFromPoint, NULL::TIMESTAMP as local_date
+        WHERE false
+        """
+
+
+def local_date_filter_sql(
+    column: str,
+    ranges: List[tuple[datetime, datetime]],
+    excluded_periods: List[tuple[datetime, datetime]],
+) -> str:
+    where = (
+        "("
+        + " OR ".join(
+            f"({column} >= '{start}' AND {column} <= '{end}')" for start, end in ranges
+        )
+        + ")"
+    )
+
+    if excluded_periods:
+        # A single anti-join on the local day, the connection must expose excluded_days
+        # (see register_calendar) so the cost does not depend on the number of excluded days
+        where += f" AND {column}::DATE NOT IN (SELECT day::DATE FROM excluded_days)"
+    return where
+
+
+def entries_sql(
+    line_id: str,
+    points_tuple: Optional[List[str]],
+    ranges: List[tuple[datetime, datetime]],
+    excluded_periods: List[tuple[datetime, datetime]],
+    selected_days: List[int],
+    start_hour: int,
+    end_hour: int,
+    use_warehouse: bool = True,
+) -> str:
+    # Raw points of a line in local time within the disjoint datetime ranges, selected_days
+    # uses the database index (0 is sunday), points_tuple None selects every point of the line
+    where_for_points = ""
+    if points_tuple is not None:
+        points = ", ".join(map(lambda x: f"'{x}'", points_tuple))
+        where_for_points = f"pointId IN ({points}) AND"
+
+    warehouse_files = None
+    if use_warehouse:
+        warehouse_files = {}
+        for start_datetime, end_datetime in ranges:
+            range_files = warehouse_files_for(line_id, start_datetime, end_datetime)
+            if range_files is None:
+                warehouse_files = None
+                break
+            warehouse_files.update(dict.fromkeys(range_files))
+
+    if warehouse_files is not None:
+        # Local time columns are precomputed in the warehouse, filters are plain column predicates
+        where_for_date_and_excluded_periods = local_date_filter_sql(
+            "local_date", ranges, excluded_periods
+        )
+        parquet_files = ",".join(map(lambda x: f"'{x}'", warehouse_files))
+        return f"""
+        SELECT '{line_id}' as lineId,pointId,directionId,distanceFromPoint,local_date
+        FROM read_parquet([{parquet_files}])
+        WHERE {where_for_points}
+        local_hour >= {start_hour} AND local_hour <= {end_hour}
+        AND local_dow IN ({', '.join(map(str, selected_days))})
+        AND {where_for_date_and_excluded_periods}
+        """
+
+    # Hours, days and exclusions are planned as UTC intervals on the raw date column, which
+    # the parquet min/max statistics can prune on, instead of per row local time conversions
+    intervals = plan_utc_intervals(
+        [(start.date(), end.date()) for start, end in ranges],
+        selected_days,
+        start_hour,
+        end_hour,
+        excluded_periods,
+    )
+
+    # Ranges can share files, each is listed once
+    remote_files = dict.fromkeys(
+        f
+        for start_datetime, end_datetime in ranges
+        for f in list_parquet_files(
+            line_id, int(start_datetime.timestamp()), int(end_datetime.timestamp())
+        )
+    )
+    # Files outside of the intervals (nights, weekends, holidays, ...) are never opened
+    remote_files = manifest.prune(list(remote_files), line_id, intervals)
+    if not remote_files:
+        return EMPTY_ENTRIES_SQL
+
+    # Read local copies, only files that were never seen before are downloaded
+    local_files = parquet_cache.localize(remote_files)
+    parquet_files = ",".join(map(lambda x: f"'{x}'", local_files))
+    # The raw scan is bounded in UTC, hours, days and exclusions are then cheap predicates
+    # on the converted local time, like the warehouse columns
+    return f"""
+        SELECT * FROM (
+            SELECT lineId,pointId,directionId,distanceFromPoint, (date AT TIME ZONE 'UTC' AT TIME ZONE 'Europe/Brussels')::timestamp as local_date
+            FROM read_parquet([{parquet_files}])
+            WHERE lineId = '{line_id}' AND {where_for_points}
+            {utc_bounds_filter_sql("date", intervals)}
+        )
+        WHERE hour(local_date) >= {start_hour} AND hour(local_date) <= {end_hour}
+        AND dayofweek(local_date) IN ({', '.join(map(str, selected_days))})
+        AND {local_date_filter_sql("local_date", ranges, excluded_periods)}
+        """
+
+
+def speed_table_sql(entries: str) -> str:
+    # Dedupe, lag deltas and speed gate, the caller selects from speedTable
+    return f"""WITH entries AS ({entries}), filtered_entries AS (
+        SELECT
+            *,
+            count(*) OVER (PARTITION BY directionId, pointId, local_date) as row_count
+        FROM entries
+    ), deltaTable as (
+    SELECT
+        local_date,
+        lineId as lineId,
+        directionId as directionId,
+        pointId as pointId,
+        distanceFromPoint as distanceFromPoint,
+        distanceFromPoint - lag(distanceFromPoint) OVER (PARTITION BY pointId, directionId,lineId ORDER BY local_date) AS distance_delta,
+        (local_date - lag(local_date) OVER (PARTITION BY pointId, directionId, lineId ORDER BY local_date)) as time_delta
+    FROM filtered_entries
+    WHERE row_count = 1
+    ), speedTable as (
+    SELECT
+       local_date,
+        lineId,
+        directionId,
+        pointId,
+        distanceFromPoint,
+        (distance_delta / epoch(time_delta)) as speed
+        FROM deltaTable
+        WHERe epoch(time_delta) < 30 AND distance_delta < 600
+    )"""
+
+
+def merge_periods(periods) -> List[tuple[date, date]]:
+    # Union of (start, end) date periods as sorted disjoint periods
+    merged = []
+    for start, end in sorted(periods):
+        if merged and start <= merged[-1][1] + timedelta(days=1):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def days_as_periods(days) -> List[tuple[date, date]]:
+    # Coalesce a set of dates into (start, end) periods of consecutive days
+    periods = []
+    for day in sorted(days):
+        if periods and periods[-1][1] + timedelta(days=1) == day:
+            periods[-1] = (periods[-1][0], day)
+        else:
+            periods.append((day, day))
+    return periods
@@ -0,0 +1,56 @@
+from datetime import date, datetime, time, timedelta, timezone
+from typing import List
+from zoneinfo import ZoneInfo
+
+BRUSSELS = ZoneInfo("Europe/Brussels")
+
+
+def _to_utc(local: datetime) -> datetime:
+    # Naive UTC, like the date column of the raw files. With the default fold=0 an ambiguous
+    # time (October) is its first occurrence and a skipped time (March) is shifted forward
+    return local.replace(tzinfo=BRUSSELS).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def plan_utc_intervals(
+    spans: List[tuple[date, date]],
+    selected_days: List[int],
+    start_hour: int,
+    end_hour: int,
+    excluded_periods: List[tuple[date, date]],
+) -> List[tuple[datetime, datetime]]:
+    """Expand local filters into the sorted, disjoint UTC [from, to) intervals they select.
+
+    Each selected day of the spans (selected_days uses the database index, 0 is sunday)
+    that is not excluded contributes start_hour:00 to end_hour+1:00 local time, adjacent
+    intervals are merged so that a query on every hour of every day is a single interval.
+    """
+    intervals = []
+    for span_start, span_end in spans:
+        day = span_start
+        while day <= span_end:
+            if day.isoweekday() % 7 in selected_days and not any(
+                start <= day <= end for start, end in excluded_periods
+            ):
+                local_start = datetime.combine(day, time(start_hour))
+                local_end = datetime.combine(day, time(end_hour)) + timedelta(hours=1)
+                utc_start, utc_end = _to_utc(local_start), _to_utc(local_end)
+                # Empty when the selected hours do not exist that day (DST switch)
+                if utc_start < utc_end:
+                    intervals.append((utc_start, utc_end))
+            day += timedelta(days=1)
+
+    merged = []
+    for utc_start, utc_end in sorted(intervals):
+        if merged and utc_start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], utc_end))
+        else:
+            merged.append((utc_start, utc_end))
+    return merged
+
+
+def utc_bounds_filter_sql(column: str, intervals: List[tuple[datetime, datetime]]) -> str:
+    # Only the overall [first, last) bounds, a plain range the parquet statistics prune on.
+    # Rows between the intervals are filtered on their local time by the caller
+    if not intervals:
+        return "false"
+    return f"{column} >= '{intervals[0][0]}' AND {column} < '{intervals[-1][1]}'"
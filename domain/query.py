@@ -1,36 +1,54 @@
-import json
+import contextvars
 import logging
-from datetime import datetime
-from enum import Enum
-from typing import List
+import math
+import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime
+from typing import Callable, Iterator, List, Optional
 
-import duckdb
 import pandas as pd
-import requests
-import requests.utils
 
+from domain.calendar_dimension import register_calendar
+from domain.config import QUERY_WORKERS, SPEED_ENGINE
+from domain.database import database
+from domain.engines import ENGINES
+from domain.governor import governor
+from domain.pipeline import (
+    BY_MODE_COLUMNS,
+    SpeedComputationMode,
+    count_column,
+    days_as_periods,
+    entries_sql,
+    merge_periods,
+    sum_column,
+)
+from domain.result_cache import day_cache
+from domain.rollup import read_rollups
 
-def auth_request(*args, **kwargs):
-    return requests.get(
-        *args,
-        **kwargs,
-        headers={
-            "Authorization": f"Bearer 42227799ae2e74ebc42ca66dee38f4352456c2e93a21962133e0056fd228392eecd70222df0a0c3882438acdfb59de933c50ef368cebb8f5ab8b19d3bd8d2134"
-        },
-    )
-
+RESULT_COLUMNS = ["lineId", "directionId", "pointId", "speed", "count", "date"]
+# Fractions of the days successively covered by iter_average_speed_for_periods
+APPROXIMATE_STEPS = (0.1, 0.3, 1.0)
 
-class SpeedComputationMode(Enum):
-    GREATER_THAN_ZERO = 1
-    GREATER_THAN_ZERO_IF_CLOSE_TO_STOP = 2
-    ALL = 3
+_periods_pool = ThreadPoolExecutor(
+    max_workers=QUERY_WORKERS, thread_name_prefix="periods"
+)
 
 
-MAPPING_SPEED_COMPUTATION_MODE = {
-    SpeedComputationMode.GREATER_THAN_ZERO: "speed > 0",
-    SpeedComputationMode.GREATER_THAN_ZERO_IF_CLOSE_TO_STOP: "distanceFromPoint > 50 or speed > 0",
-    SpeedComputationMode.ALL: "speed >= 0",
-}
+def select_speed_computation_mode(
+    results_df: pd.DataFrame, speed_computation_mode: SpeedComputationMode
+) -> pd.DataFrame:
+    # Average speed (km/h) and count of one mode out of the per mode sums and counts,
+    # buckets without any speed for the mode are dropped, other columns (period) are kept
+    count = count_column(speed_computation_mode)
+    selected_df = results_df[results_df[count] > 0].copy()
+    selected_df["speed"] = (
+        selected_df[sum_column(speed_computation_mode)] / selected_df[count] * 3.6
+    )
+    selected_df["count"] = selected_df[count]
+    extra_columns = [
+        column for column in results_df.columns if column not in BY_MODE_COLUMNS
+    ]
+    return selected_df[RESULT_COLUMNS + extra_columns].reset_index(drop=True)
 
 
 def get_average_speed_for(
@@ -42,89 +60,270 @@ def get_average_speed_for(
     selected_days_index: List[int],
     start_hour: int,
     end_hour: int,
-    speed_computation_mode: SpeedComputationMode = SpeedComputationMode.ALL,
+    speed_computation_mode: Optional[SpeedComputationMode] = SpeedComputationMode.ALL,
+    use_warehouse: bool = True,
+    use_rollups: bool = True,
+    use_day_cache: bool = True,
+    engine: str = SPEED_ENGINE,
 ) -> pd.DataFrame:
-    # selected days index is in human index, convert to database index (0 is sunday)
+    # engine is the name of one of the ENGINES computing the speeds from raw data, the
+    # configured one by default (STIB_SPEED_ENGINE). Without speed computation mode, the
+    # sums and counts of every mode (BY_MODE_COLUMNS) are returned so that any of them
+    # can be selected later on with select_speed_computation_mode.
+    # The query waits for its turn and may raise QueryCancelled, see domain.governor
+    with governor.admit():
+        results_df = _get_average_speed_for_spans(
+            line_id,
+            points_tuple,
+            [(start_date, end_date)],
+            excluded_periods,
+            selected_days_index,
+            start_hour,
+            end_hour,
+            use_warehouse,
+            use_rollups,
+            use_day_cache,
+            engine,
+        )
+    if speed_computation_mode is None:
+        return results_df
+    return select_speed_computation_mode(results_df, speed_computation_mode)
+
+
+def get_average_speed_for_periods(
+    line_id: str,
+    points_tuple: List[str],
+    periods: List[tuple[datetime, datetime]],
+    excluded_periods: List[tuple[datetime, datetime]],
+    selected_days_index: List[int],
+    start_hour: int,
+    end_hour: int,
+    speed_computation_mode: Optional[SpeedComputationMode] = SpeedComputationMode.ALL,
+    use_warehouse: bool = True,
+    use_rollups: bool = True,
+    use_day_cache: bool = True,
+    engine: str = SPEED_ENGINE,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> pd.DataFrame:
+    # Overlapping and adjacent periods are merged and scanned once, the disjoint spans left
+    # run concurrently on the shared pool. Each bucket is then tagged with the number (1, 2,
+    # ...) of the periods it belongs to, overlapping periods share buckets. progress is called
+    # with (done, total) spans from the calling thread as they complete
+    spans = merge_periods(periods)
+    with governor.admit():
+        # The spans run under the ticket of the query, each in its own copy of the context
+        futures = [
+            _periods_pool.submit(
+                contextvars.copy_context().run,
+                _get_average_speed_for_spans,
+                line_id,
+                points_tuple,
+                [span],
+                excluded_periods,
+                selected_days_index,
+                start_hour,
+                end_hour,
+                use_warehouse,
+                use_rollups,
+                use_day_cache,
+                engine,
+            )
+            for span in spans
+        ]
+        try:
+            for done, _ in enumerate(as_completed(futures), 1):
+                if progress is not None:
+                    progress(done, len(futures))
+        finally:
+            for future in futures:
+                future.cancel()
+        results_df = pd.concat(
+            [future.result() for future in futures], ignore_index=True
+        )
+    results_df = _tag_periods(results_df, periods)
+    if speed_computation_mode is None:
+        return results_df
+    return select_speed_computation_mode(results_df, speed_computation_mode)
+
+
+def iter_average_speed_for_periods(
+    line_id: str,
+    points_tuple: List[str],
+    periods: List[tuple[datetime, datetime]],
+    excluded_periods: List[tuple[datetime, datetime]],
+    selected_days_index: List[int],
+    start_hour: int,
+    end_hour: int,
+    steps: tuple[float, ...] = APPROXIMATE_STEPS,
+    use_warehouse: bool = True,
+    use_rollups: bool = True,
+    engine: str = SPEED_ENGINE,
+) -> Iterator[tuple[float, pd.DataFrame]]:
+    """Yield the results of get_average_speed_for_periods (every mode) on a growing sample of the days.
+
+    Each step adds a random sample of the remaining selected days until the fraction
+    of the days it covers is reached, the other days are excluded. The days of the
+    previous steps come from the day cache so that only the new ones are scanned, the
+    last step covers every day and is exact. Yields (fraction of the days, results).
+    """
     selected_days = [i % 7 for i in selected_days_index]
+    spans = merge_periods(periods)
+    days = sorted(_requested_days(spans, selected_days, excluded_periods))
+    # Same order on every run so that the samples are reused by identical queries
+    random.Random(0).shuffle(days)
 
-    points = ", ".join(map(lambda x: f"'{x}'", points_tuple))
+    for fraction in steps:
+        sampled_days = days[: math.ceil(fraction * len(days))]
+        not_sampled_days = days_as_periods(set(days) - set(sampled_days))
+        # Admitted step by step, the queries waiting in line can run between two previews
+        with governor.admit():
+            results_df = _get_average_speed_for_spans(
+                line_id,
+                points_tuple,
+                spans,
+                list(excluded_periods) + not_sampled_days,
+                selected_days_index,
+                start_hour,
+                end_hour,
+                use_warehouse,
+                use_rollups,
+                True,
+                engine,
+            )
+        fraction_done = len(sampled_days) / len(days) if days else 1.0
+        yield fraction_done, _tag_periods(results_df, periods)
+        if len(sampled_days) == len(days):
+            return
 
-    start_datetime = datetime(
-        start_date.year, start_date.month, start_date.day, start_hour
-    )
-    end_datetime = datetime(end_date.year, end_date.month, end_date.day, end_hour, 59)
 
-    # Convert to EU timezone
+def _tag_periods(results_df, periods):
+    # The period numbers share one categorical dtype, the concatenation keeps it
+    bucket_days = results_df["date"].dt.date
+    period_dtype = pd.CategoricalDtype([str(i + 1) for i in range(len(periods))])
+    tagged = []
+    for i, (start, end) in enumerate(periods):
+        period_df = results_df[(bucket_days >= start) & (bucket_days <= end)]
+        tagged.append(
+            period_df.assign(
+                period=pd.Series(str(i + 1), index=period_df.index, dtype=period_dtype)
+            )
+        )
+    return pd.concat(tagged, ignore_index=True)
 
-    min_date_utc = int(start_datetime.timestamp())
-    max_date_utc = int(end_datetime.timestamp())
 
-    keys = {"lineId": line_id}
-    keys_url = requests.utils.quote(json.dumps(keys))
-    response = auth_request(
-        f"https://api.mobilitytwin.brussels/parquetized?start_timestamp={min_date_utc}&end_timestamp={max_date_utc}&component=stib_vehicle_distance_parquetize&keys={keys_url}"
-    ).json()
+def _requested_days(spans, selected_days, excluded_periods):
+    return {
+        day
+        for start_date, end_date in spans
+        for day in pd.date_range(start_date, end_date).date
+        if day.isoweekday() % 7 in selected_days
+        and not any(start <= day <= end for start, end in excluded_periods)
+    }
 
-    logging.info(f"{start_datetime}, {end_datetime}, {min_date_utc}, {max_date_utc}")
 
-    WHERE_FOR_DATE_AND_EXCLUDED_PERIODS = (
-        f"(local_date >= '{start_datetime}' AND local_date <= '{end_datetime}')"
-    )
+def _get_average_speed_for_spans(
+    line_id: str,
+    points_tuple: List[str],
+    spans: List[tuple[datetime, datetime]],
+    excluded_periods: List[tuple[datetime, datetime]],
+    selected_days_index: List[int],
+    start_hour: int,
+    end_hour: int,
+    use_warehouse: bool,
+    use_rollups: bool,
+    use_day_cache: bool,
+    engine: str,
+) -> pd.DataFrame:
+    # selected days index is in human index, convert to database index (0 is sunday)
+    selected_days = [i % 7 for i in selected_days_index]
 
-    if excluded_periods:
-        WHERE_FOR_DATE_AND_EXCLUDED_PERIODS += " AND "
-        WHERE_FOR_DATE_AND_EXCLUDED_PERIODS += " AND ".join(
-            [
-                f"(local_date < '{start}' OR datetrunc( 'day',local_date) > '{end}')"
-                for start, end in excluded_periods
-            ]
+    # The end hour is inclusive up to its last microsecond, like on the other days of the range
+    ranges = [
+        (
+            datetime(start_date.year, start_date.month, start_date.day, start_hour),
+            datetime(
+                end_date.year, end_date.month, end_date.day, end_hour, 59, 59, 999999
+            ),
         )
+        for start_date, end_date in spans
+    ]
+
+    logging.info(f"{ranges}")
 
-    parquet_files = ",".join(map(lambda x: f"'{x}'", response["results"]))
-
-    query = f"""WITH entries AS (   
-        SELECT lineId,pointId,directionId,distanceFromPoint, (date AT TIME ZONE 'UTC' AT TIME ZONE 'Europe/Brussels')::timestamp as local_date
-        FROM read_parquet([{parquet_files}])
-        WHERE lineId = '{line_id}' AND pointId IN ({points}) AND
-        extract(hour from local_date) >= {start_hour} AND extract(hour from local_date) <= {end_hour} 
-        AND extract(dow from local_date) IN ({', '.join(map(str, selected_days))}) 
-        AND {WHERE_FOR_DATE_AND_EXCLUDED_PERIODS}  
-
-    ), filtered_entries AS (
-        SELECT 
-            *,
-            count(*) OVER (PARTITION BY directionId, pointId, local_date) as row_count
-        FROM entries
-    ), deltaTable as (
-    SELECT 
-        local_date,
-        lineId as lineId,
-        directionId as directionId,
-        pointId as pointId,
-        distanceFromPoint as distanceFromPoint,
-        distanceFromPoint - lag(distanceFromPoint) OVER (PARTITION BY pointId, directionId,lineId ORDER BY local_date) AS distance_delta,
-        (local_date - lag(local_date) OVER (PARTITION BY pointId, directionId, lineId ORDER BY local_date)) as time_delta
-    FROM filtered_entries
-    WHERE row_count = 1
-    ), speedTable as (
-    SELECT 
-       local_date,
-        lineId,
-        directionId,
-        pointId,
-        distanceFromPoint,
-        (distance_delta / epoch(time_delta)) as speed
-        FROM deltaTable
-        WHERe epoch(time_delta) < 30 AND distance_delta < 600
+    rollup_days, rollup_results = set(), None
+    if use_rollups:
+        rollup_days, rollup_results = read_rollups(
+            line_id,
+            points_tuple,
+            ranges,
+            excluded_periods,
+            selected_days,
+            start_hour,
+            end_hour,
+        )
+
+    requested_days = _requested_days(spans, selected_days, excluded_periods)
+    if rollup_results is not None and requested_days <= rollup_days:
+        return rollup_results
+
+    # Days already computed by previous queries with the same points and hours
+    cached_results = {}
+    if use_day_cache:
+        for day in requested_days - rollup_days:
+            day_results = day_cache.get(
+                _day_cache_key(line_id, points_tuple, start_hour, end_hour, day)
+            )
+            if day_results is not None:
+                cached_results[day] = day_results
+    partial_results = list(cached_results.values())
+    if rollup_results is not None:
+        partial_results.append(rollup_results)
+
+    missing_days = requested_days - rollup_days - set(cached_results)
+    if not missing_days and partial_results:
+        return pd.concat(partial_results, ignore_index=True)
+
+    # Raw data is only scanned for the days neither the rollups nor the day cache cover
+    raw_excluded_periods = list(excluded_periods) + days_as_periods(
+        rollup_days | set(cached_results)
     )
-    SELECT  lineId, directionId, pointId, avg(speed) * 3.6, count(*) as count, time_bucket(interval '15 minutes', local_date) as agg
-    FROM speedTable
-    WHERE {MAPPING_SPEED_COMPUTATION_MODE[speed_computation_mode]}
-    GROUP BY lineId, directionId, pointId, agg
-    """
-    con = duckdb.connect()
-    results_df = con.execute(query).df()
-    columns = ["lineId", "directionId", "pointId", "speed", "count", "date"]
-    results_df.columns = columns
-    results_df.to_csv("results.csv", index=False)
+    entries = entries_sql(
+        line_id,
+        points_tuple,
+        ranges,
+        raw_excluded_periods,
+        selected_days,
+        start_hour,
+        end_hour,
+        use_warehouse=use_warehouse,
+    )
+
+    con = database.cursor()
+    register_calendar(con, raw_excluded_periods)
+    with governor.executing(con):
+        results_df = ENGINES[engine].compute(con, entries)
+
+    if use_day_cache:
+        # Past days are complete, their sums and counts can be merged into any later query.
+        # The results are split by day in a single pass, days without rows are cached empty
+        today = date.today()
+        day_groups = {
+            bucket_day.date(): day_results
+            for bucket_day, day_results in results_df.groupby(
+                results_df["date"].dt.normalize(), sort=False
+            )
+        }
+        for day in missing_days:
+            if day < today:
+                day_cache.put(
+                    _day_cache_key(line_id, points_tuple, start_hour, end_hour, day),
+                    day_groups.get(day, results_df.iloc[:0]),
+                )
+
+    if partial_results:
+        results_df = pd.concat(partial_results + [results_df], ignore_index=True)
     return results_df
+
+
+def _day_cache_key(line_id, points_tuple, start_hour, end_hour, day):
+    return line_id, tuple(sorted(points_tuple)), start_hour, end_hour, day
@@ -0,0 +1,130 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional
+
+import pandas as pd
+
+from domain.config import (
+    DAY_CACHE_MAX_BYTES,
+    DAY_CACHE_TTL_SECONDS,
+    RESULT_CACHE_MAX_BYTES,
+    RESULT_CACHE_TTL_SECONDS,
+)
+from domain.governor import QueryCancelled
+
+
+class _Flight:
+    # A computation in progress, the callers asking for the same key wait on it
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ResultCache:
+    """Server-wide cache of query results with TTL, byte budget and request coalescing.
+
+    Entries are evicted once older than ``ttl_seconds`` or, least recently used first,
+    when the results together exceed ``max_bytes``. While a key is being computed the
+    other callers asking for it wait for that computation instead of starting their own.
+    Callers always get their own copy of the dataframe.
+    """
+
+    def __init__(self, ttl_seconds: int, max_bytes: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _lookup(self, key: Hashable):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        created_at, size, results_df = entry
+        if time.monotonic() - created_at > self.ttl_seconds:
+            del self._entries[key]
+            self._bytes -= size
+            return None
+        self._entries.move_to_end(key)
+        return results_df
+
+    def _store(self, key: Hashable, results_df: pd.DataFrame):
+        size = int(results_df.memory_usage(deep=True).sum())
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[1]
+        self._entries[key] = (time.monotonic(), size, results_df)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+
+    def get(self, key: Hashable) -> Optional[pd.DataFrame]:
+        # The cached dataframe itself, it must not be modified
+        if not self.enabled:
+            return None
+        with self._lock:
+            return self._lookup(key)
+
+    def put(self, key: Hashable, results_df: pd.DataFrame):
+        if self.enabled:
+            with self._lock:
+                self._store(key, results_df)
+
+    def get_or_compute(
+        self, key: Hashable, compute: Callable[[], pd.DataFrame]
+    ) -> pd.DataFrame:
+        if not self.enabled:
+            return compute()
+
+        while True:
+            with self._lock:
+                results_df = self._lookup(key)
+                if results_df is not None:
+                    return results_df.copy()
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = _Flight()
+                    self._flights[key] = flight
+            if leader:
+                break
+
+            logging.info("Result cache: waiting for an identical query")
+            flight.done.wait()
+            if isinstance(flight.error, QueryCancelled) and flight.error.reason not in (
+                "timeout",
+                "memory",
+            ):
+                # Cancelled for the session that led it, not for this one
+                continue
+            if flight.error is not None:
+                raise flight.error
+            return flight.result.copy()
+
+        try:
+            flight.result = compute()
+            with self._lock:
+                self._store(key, flight.result)
+            return flight.result.copy()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+
+result_cache = ResultCache(RESULT_CACHE_TTL_SECONDS, RESULT_CACHE_MAX_BYTES)
+# Per day partial aggregates (sums and counts) the queries are composed of
+day_cache = ResultCache(DAY_CACHE_TTL_SECONDS, DAY_CACHE_MAX_BYTES)
@@ -0,0 +1,273 @@
+import atexit
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Union
+
+import pandas as pd
+import pyarrow as pa
+
+from domain.config import (
+    RESULT_STORE_DIRECTORY,
+    RESULT_STORE_IDLE_SECONDS,
+    RESULT_STORE_MAX_BYTES,
+)
+from domain.ipc import results_from_ipc, results_to_ipc
+
+
+def projection(
+    results: pd.DataFrame, columns: Union[List[str], Dict[str, str]]
+) -> pd.DataFrame:
+    # Frame of some columns of results sharing their arrays, unlike results[columns].
+    # columns is a list of names or a {name: column of results} mapping
+    if not isinstance(columns, dict):
+        columns = {column: column for column in columns}
+    return pd.DataFrame(
+        {name: results[column] for name, column in columns.items()}, copy=False
+    )
+
+
+class _Entry:
+    __slots__ = (
+        "key",
+        "version",
+        "results",
+        "size",
+        "views",
+        "views_size",
+        "path",
+        "used_at",
+        "spilling",
+    )
+
+    def __init__(self, key: tuple, results: pd.DataFrame):
+        self.key = key
+        self.version = uuid.uuid4().hex
+        self.results = results
+        self.size = int(results.memory_usage(deep=True).sum())
+        # Datasets derived from the results (see view), only while they are in memory
+        self.views = {}
+        self.views_size = 0
+        # Arrow IPC copy on disk once spilled, kept until the entry is removed
+        self.path = None
+        self.used_at = time.monotonic()
+        self.spilling = False
+
+
+class ResultStore:
+    """Results shown by the sessions, one per (session, name), within a process budget.
+
+    The results of every session share ``max_bytes`` of memory. Once over budget, the
+    least recently used results are spilled to an Arrow IPC file and dropped from
+    memory, the results not used for ``idle_seconds`` are spilled as well. Spills
+    are written by a background thread, woken up by ``put`` and ``get`` when over
+    budget. A spilled result is read back on its next ``get``, its file is written
+    only once. Results are removed when replaced or when their session is gone
+    (``session_alive``). Datasets derived from a result (``view``) count in its
+    bytes and are dropped with it.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, idle_seconds: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        # Replaced by the app, without a server every session is alive
+        self.session_alive: Callable[[str], bool] = lambda session_id: True
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._spill_directory = None
+        self._spiller: Optional[threading.Thread] = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+
+    def put(self, session_id: Optional[str], name: str, results: pd.DataFrame) -> str:
+        # results must not be modified afterwards, returns the version of the result
+        entry = _Entry((session_id, name), results)
+        with self._lock:
+            previous = self._entries.pop((session_id, name), None)
+            if previous is not None:
+                self._forget(previous)
+            self._entries[(session_id, name)] = entry
+            self._bytes += entry.size
+        self._enforce()
+        return entry.version
+
+    def get(self, session_id: Optional[str], name: str) -> Optional[pd.DataFrame]:
+        # The stored results themselves, they must not be modified
+        with self._lock:
+            entry = self._entries.get((session_id, name))
+            if entry is None:
+                return None
+            self._entries.move_to_end((session_id, name))
+            entry.used_at = time.monotonic()
+            results, path = entry.results, entry.path
+
+        if results is None:
+            logging.info(f"Result store: reading {name} of session {session_id}")
+            results = results_from_ipc(pa.memory_map(path))
+            with self._lock:
+                if self._entries.get((session_id, name)) is entry:
+                    if entry.results is None:
+                        entry.results = results
+                        self._bytes += entry.size
+                    else:
+                        results = entry.results
+        self._enforce()
+        return results
+
+    def view(
+        self,
+        session_id: Optional[str],
+        name: str,
+        key: Hashable,
+        build: Callable[[pd.DataFrame], Any],
+    ) -> Any:
+        # Dataset derived from the stored results by build (its nbytes attribute is its
+        # memory), built once per key until the results are spilled or replaced
+        with self._lock:
+            entry = self._entries.get((session_id, name))
+            if entry is None:
+                return None
+            view = entry.views.get(key)
+            if view is not None:
+                self._entries.move_to_end((session_id, name))
+                entry.used_at = time.monotonic()
+                return view
+
+        results = self.get(session_id, name)
+        if results is None:
+            return None
+        view = build(results)
+        with self._lock:
+            current = self._entries.get((session_id, name))
+            if current is not None and current.results is results:
+                current.views[key] = view
+                current.views_size += view.nbytes
+                self._bytes += view.nbytes
+        self._enforce()
+        return view
+
+    def version(self, session_id: Optional[str], name: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get((session_id, name))
+            return entry.version if entry is not None else None
+
+    def remove(self, session_id: Optional[str], name: str):
+        with self._lock:
+            entry = self._entries.pop((session_id, name), None)
+            if entry is not None:
+                self._forget(entry)
+
+    @property
+    def memory_bytes(self) -> int:
+        return self._bytes
+
+    def _forget(self, entry: _Entry):
+        # Called with the lock held, once the entry left _entries
+        if entry.results is not None:
+            self._bytes -= entry.size + entry.views_size
+            entry.results = None
+            entry.views, entry.views_size = {}, 0
+        if entry.path is not None:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def _enforce(self):
+        # Results of gone sessions are removed, spilling is left to the background
+        # thread
+        with self._lock:
+            gone = [key for key in self._entries if not self.session_alive(key[0])]
+            for key in gone:
+                self._forget(self._entries.pop(key))
+            over = self._bytes > self.max_bytes
+            if self._spiller is None:
+                self._spiller = threading.Thread(
+                    target=self._spill_forever, name="result-store-spill", daemon=True
+                )
+                self._spiller.start()
+        if over:
+            self._wake.set()
+
+    def _spill_forever(self):
+        # Woken up when over budget, idle results are looked for at least every
+        # idle_seconds
+        while True:
+            self._wake.wait(timeout=self.idle_seconds)
+            self._wake.clear()
+            try:
+                self._spill_victims()
+            except Exception:
+                logging.exception("Result store: spilling failed")
+
+    def _spill_victims(self):
+        now = time.monotonic()
+        victims = []
+        with self._lock:
+            in_memory = [
+                entry
+                for entry in self._entries.values()
+                if entry.results is not None and not entry.spilling
+            ]
+            over = self._bytes - self.max_bytes
+            # The most recently used result is the one on display
+            for entry in in_memory[:-1]:
+                if over > 0 or now - entry.used_at > self.idle_seconds:
+                    victims.append(entry)
+                    over -= entry.size + entry.views_size
+            for entry in victims:
+                entry.spilling = True
+
+        for entry in victims:
+            try:
+                self._spill(entry)
+            except OSError:
+                logging.exception("Result store: could not spill a result")
+            finally:
+                entry.spilling = False
+
+    def _spill(self, entry: _Entry):
+        with self._lock:
+            results, path = entry.results, entry.path
+        if results is None:
+            return
+        if path is None:
+            directory = self._directory()
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as tmp:
+                tmp.write(results_to_ipc(results))
+            path = os.path.join(directory, f"{entry.version}.arrow")
+            os.replace(tmp_path, path)
+
+        with self._lock:
+            entry.path = path
+            if self._entries.get(entry.key) is not entry:
+                # Removed while being written
+                self._forget(entry)
+                return
+            if entry.results is None:
+                return
+            self._bytes -= entry.size + entry.views_size
+            entry.results = None
+            entry.views, entry.views_size = {}, 0
+        logging.info(f"Result store: spilled {entry.size} bytes")
+
+    def _directory(self) -> str:
+        # Private to the process, removed on exit
+        with self._lock:
+            if self._spill_directory is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._spill_directory = tempfile.mkdtemp(dir=self.directory)
+                atexit.register(shutil.rmtree, self._spill_directory, True)
+            return self._spill_directory
+
+
+result_store = ResultStore(
+    RESULT_STORE_DIRECTORY, RESULT_STORE_MAX_BYTES, RESULT_STORE_IDLE_SECONDS
+)
@@ -0,0 +1,184 @@
+import argparse
+import logging
+import os
+import time
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Set
+
+import duckdb
+import pandas as pd
+
+from domain.calendar_dimension import register_calendar
+from domain.config import ROLLUP_DATABASE_PATH
+from domain.engines import MAX_TIME_DELTA_SECONDS
+from domain.pipeline import (
+    SpeedComputationMode,
+    by_mode_frame,
+    count_column,
+    entries_sql,
+    local_date_filter_sql,
+    mode_aggregates_sql,
+    speed_table_sql,
+    sum_column,
+)
+
+
+def read_rollups(
+    line_id: str,
+    points_tuple: List[str],
+    ranges: List[tuple[datetime, datetime]],
+    excluded_periods: List[tuple[datetime, datetime]],
+    selected_days: List[int],
+    start_hour: int,
+    end_hour: int,
+) -> tuple[Set[date], Optional[pd.DataFrame]]:
+    # Days of the sorted disjoint ranges answered by the rollups and the matching 15 minutes buckets
+    # with the BY_MODE_COLUMNS, the rollups are skipped (no day, no results) when the database is not available
+    if not os.path.exists(ROLLUP_DATABASE_PATH):
+        return set(), None
+
+    try:
+        con = duckdb.connect(ROLLUP_DATABASE_PATH, read_only=True)
+    except duckdb.IOException:
+        # Locked by a running ingestion
+        logging.warning("Rollup database is not available, using raw data")
+        return set(), None
+
+    points = ", ".join(map(lambda x: f"'{x}'", points_tuple))
+    aggregates = ", ".join(
+        f"{sum_column(mode)}, {count_column(mode)}" for mode in SpeedComputationMode
+    )
+
+    try:
+        register_calendar(con, excluded_periods)
+        days = {
+            day
+            for (day,) in con.execute(
+                "SELECT day FROM rollup_days WHERE lineId = ? AND day >= ? AND day <= ?",
+                [line_id, ranges[0][0].date(), ranges[-1][1].date()],
+            ).fetchall()
+            if any(start.date() <= day <= end.date() for start, end in ranges)
+        }
+        if not days:
+            return set(), None
+
+        results_table = con.execute(
+            f"""SELECT lineId, directionId, pointId, bucket, {aggregates}
+            FROM speed_rollups
+            WHERE lineId = '{line_id}' AND pointId IN ({points})
+            AND hour(bucket) >= {start_hour} AND hour(bucket) <= {end_hour}
+            AND dayofweek(bucket) IN ({', '.join(map(str, selected_days))})
+            AND {local_date_filter_sql("bucket", ranges, excluded_periods)}
+            """
+        ).fetch_arrow_table()
+    except duckdb.CatalogException:
+        # Nothing ingested yet
+        return set(), None
+    finally:
+        con.close()
+
+    return days, by_mode_frame(results_table)
+
+
+def ingest_day(con: duckdb.DuckDBPyConnection, line_id: str, day: date) -> bool:
+    day_start = datetime(day.year, day.month, day.day)
+    day_end = day_start.replace(hour=23, minute=59, second=59, microsecond=999999)
+    # The points of the last seconds before midnight are the lag() of the first points
+    # of the day, nothing earlier of the previous day is listed or scanned
+    entries = entries_sql(
+        line_id,
+        None,
+        [(day_start - timedelta(seconds=MAX_TIME_DELTA_SECONDS), day_end)],
+        [],
+        list(range(7)),
+        0,
+        23,
+    )
+    query = f"""{speed_table_sql(entries)}
+    SELECT lineId, directionId, pointId, time_bucket(interval '15 minutes', local_date) as bucket,
+    {mode_aggregates_sql()}
+    FROM speedTable
+    WHERE local_date >= '{day_start}'
+    GROUP BY lineId, directionId, pointId, bucket
+    """
+
+    try:
+        con.execute(f"CREATE OR REPLACE TEMP TABLE day_rollups AS {query}")
+    except duckdb.Error as e:
+        logging.warning(f"Could not ingest line {line_id} for {day}: {e}")
+        return False
+
+    con.execute("BEGIN TRANSACTION")
+    # Keep the column types of the source data
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS speed_rollups AS SELECT * FROM day_rollups LIMIT 0"
+    )
+    con.execute(
+        "DELETE FROM speed_rollups WHERE lineId = ? AND bucket >= ? AND bucket < ?",
+        [line_id, day_start, day_start + timedelta(days=1)],
+    )
+    con.execute("INSERT INTO speed_rollups SELECT * FROM day_rollups")
+    con.execute(
+        "INSERT OR REPLACE INTO rollup_days VALUES (?, ?, current_localtimestamp())",
+        [line_id, day],
+    )
+    con.execute("COMMIT")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Extend the 15 minutes speed rollups of a line, one day at a time"
+    )
+    parser.add_argument("line_id")
+    parser.add_argument(
+        "start_day",
+        nargs="?",
+        type=date.fromisoformat,
+        help="First day to ingest, defaults to the day after the last ingested one",
+    )
+    parser.add_argument(
+        "end_day",
+        nargs="?",
+        type=date.fromisoformat,
+        help="Last day to ingest, defaults to yesterday",
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="Ingest again days already ingested"
+    )
+    args = parser.parse_args()
+
+    # Same as the app, naive datetimes are Brussels local time
+    os.environ["TZ"] = "Europe/Brussels"
+    time.tzset()
+
+    logging.basicConfig(level=logging.INFO)
+    os.makedirs(os.path.dirname(ROLLUP_DATABASE_PATH), exist_ok=True)
+    con = duckdb.connect(ROLLUP_DATABASE_PATH)
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS rollup_days (lineId VARCHAR, day DATE, ingested_at TIMESTAMP, PRIMARY KEY (lineId, day))"
+    )
+
+    ingested = {
+        day
+        for (day,) in con.execute(
+            "SELECT day FROM rollup_days WHERE lineId = ?", [args.line_id]
+        ).fetchall()
+    }
+    # Only complete days are ingested
+    end_day = args.end_day or date.today() - timedelta(days=1)
+    start_day = args.start_day
+    if start_day is None:
+        start_day = max(ingested) + timedelta(days=1) if ingested else end_day
+
+    day = start_day
+    while day <= end_day:
+        if args.force or day not in ingested:
+            if ingest_day(con, args.line_id, day):
+                logging.info(f"Ingested line {args.line_id} for {day}")
+        day += timedelta(days=1)
+    con.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import logging
+import threading
+from typing import Optional
+
+import geopandas
+import numpy as np
+
+from domain.config import SNAPSHOT_DIRECTORY, SNAPSHOT_REFRESH_SECONDS
+from domain.snapshots import Snapshot
+
+
+# Bumped whenever build_segments changes the segments table
+SEGMENTS_BUILD_VERSION = 1
+
+
+def build_segments(features: dict) -> geopandas.GeoDataFrame:
+    # Segments table of the snapshot sorted by (line_id, direction, start), delta_distance
+    # is the distance from the previous segment of the line and direction in API order
+    segments_gdf = geopandas.GeoDataFrame.from_features(features)
+    keys = ["line_id", "direction"]
+    segments_gdf["delta_distance"] = segments_gdf.groupby(keys)["distance"].diff()
+    return segments_gdf.sort_values(by=[*keys, "start"], kind="stable").reset_index(
+        drop=True
+    )
+
+
+class SegmentIndex:
+    """Segments of the whole network kept as columnar arrays.
+
+    Rows are ordered by (line_id, direction, start) (see build_segments) so that
+    the segments of a line and direction are a contiguous slice, looked up in a dict.
+    ``delta_distance`` is computed once for the whole network.
+    """
+
+    def __init__(self, segments_gdf: geopandas.GeoDataFrame):
+        self.crs = segments_gdf.crs
+        self.columns = {
+            column: segments_gdf[column].to_numpy() for column in segments_gdf.columns
+        }
+        # (line_id, direction) -> [first row, last row + 1)
+        self._slices = {}
+        line_ids, directions = self.columns["line_id"], self.columns["direction"]
+        boundaries = np.flatnonzero(
+            (line_ids[1:] != line_ids[:-1]) | (directions[1:] != directions[:-1])
+        )
+        starts = np.concatenate([[0], boundaries + 1])
+        ends = np.concatenate([boundaries + 1, [len(line_ids)]])
+        for start, end in zip(starts, ends):
+            if end > start:
+                self._slices[(line_ids[start], directions[start])] = (start, end)
+
+    def __len__(self) -> int:
+        return len(self.columns["line_id"])
+
+    def lookup(self, line_id, direction: int) -> geopandas.GeoDataFrame:
+        # Segments of one line and direction (1 or 2, as in the API)
+        start, end = self._slices.get((line_id, direction), (0, 0))
+        return geopandas.GeoDataFrame(
+            {column: values[start:end] for column, values in self.columns.items()},
+            geometry="geometry",
+            crs=self.crs,
+        )
+
+
+segments_snapshot = Snapshot(
+    "segments",
+    "/stib/segments",
+    build_segments,
+    SEGMENTS_BUILD_VERSION,
+    SNAPSHOT_DIRECTORY,
+    SNAPSHOT_REFRESH_SECONDS,
+)
+_index: Optional[SegmentIndex] = None
+_index_version: Optional[str] = None
+_lock = threading.Lock()
+
+
+def segment_index() -> SegmentIndex:
+    # Rebuilt only when the snapshot moved to another version of the segments
+    global _index, _index_version
+    version, segments_gdf = segments_snapshot.table()
+    with _lock:
+        if version != _index_version:
+            _index = SegmentIndex(segments_gdf)
+            _index_version = version
+            logging.info(f"Segment index: {len(_index)} segments")
+        return _index
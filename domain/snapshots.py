@@ -0,0 +1,172 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Callable, Optional
+
+import geopandas
+
+from domain.api import api
+
+# Versions of a table kept on disk, older ones are removed after a refresh
+SNAPSHOT_VERSIONS_KEPT = 2
+
+
+class Snapshot:
+    """Processed network table (stops, segments) persisted as versioned GeoParquet.
+
+    ``build`` turns the GeoJSON of ``endpoint`` into the table, ``build_version`` is
+    bumped whenever its output changes. Each version is written once to
+    ``<name>-<sha256 of the build version and GeoJSON>.parquet`` and ``<name>.json``
+    points to the current one with the ETag / Last-Modified it was built from, a
+    version of another build is rebuilt instead of being revalidated. The
+    current version is read memory-mapped on first use, then revalidated against
+    the API in a background thread every ``refresh_seconds``: a changed upstream
+    is built into a new version and swapped in, an unchanged one costs a 304.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        endpoint: str,
+        build: Callable[[dict], geopandas.GeoDataFrame],
+        build_version: int,
+        directory: str,
+        refresh_seconds: int,
+    ):
+        self.name = name
+        self.endpoint = endpoint
+        self.build = build
+        self.build_version = build_version
+        self.directory = directory
+        self.refresh_seconds = refresh_seconds
+        self._version: Optional[str] = None
+        self._table: Optional[geopandas.GeoDataFrame] = None
+        # Last revalidation against the API, None until the first one
+        self._checked_at: Optional[float] = None
+        self._refreshing = False
+        # Reentrant, the first build happens within table()
+        self._lock = threading.RLock()
+
+    @property
+    def _pointer_path(self) -> str:
+        return os.path.join(self.directory, f"{self.name}.json")
+
+    def _table_path(self, version: str) -> str:
+        return os.path.join(self.directory, f"{self.name}-{version}.parquet")
+
+    def _read_pointer(self) -> Optional[dict]:
+        # Pointer to the current version if it is on disk and of this build
+        try:
+            with open(self._pointer_path) as pointer_file:
+                pointer = json.load(pointer_file)
+        except (FileNotFoundError, ValueError):
+            return None
+        if pointer.get("build_version") != self.build_version or not os.path.exists(
+            self._table_path(pointer["version"])
+        ):
+            return None
+        return pointer
+
+    def table(self) -> tuple[str, geopandas.GeoDataFrame]:
+        # Current (version, table), the table is shared and must not be modified
+        with self._lock:
+            if self._table is None:
+                pointer = self._read_pointer()
+                if pointer is not None:
+                    self._table = geopandas.read_parquet(
+                        self._table_path(pointer["version"]), memory_map=True
+                    )
+                    self._version = pointer["version"]
+                else:
+                    # First start, nothing to serve until the table is built
+                    self._refresh()
+                    self._checked_at = time.monotonic()
+            if not self._refreshing and (
+                self._checked_at is None
+                or time.monotonic() - self._checked_at > self.refresh_seconds
+            ):
+                self._refreshing = True
+                threading.Thread(
+                    target=self._refresh_in_background,
+                    name=f"snapshot-{self.name}",
+                    daemon=True,
+                ).start()
+            return self._version, self._table
+
+    def _refresh_in_background(self):
+        try:
+            self._refresh()
+        except Exception:
+            logging.exception(f"Snapshot {self.name}: refresh failed")
+        finally:
+            self._checked_at = time.monotonic()
+            self._refreshing = False
+
+    def _refresh(self):
+        pointer = self._read_pointer()
+        headers = {}
+        if pointer is not None:
+            if pointer.get("etag"):
+                headers["If-None-Match"] = pointer["etag"]
+            if pointer.get("last_modified"):
+                headers["If-Modified-Since"] = pointer["last_modified"]
+
+        response = api.get(self.endpoint, headers=headers)
+        if response.status_code == 304:
+            version = pointer["version"]
+            if version != self._version:
+                # Written meanwhile by another process
+                self._swap(version, geopandas.read_parquet(self._table_path(version)))
+            return
+        response.raise_for_status()
+
+        digest = hashlib.sha256(f"{self.build_version}:".encode("utf-8"))
+        digest.update(response.content)
+        version = digest.hexdigest()[:16]
+        if version == self._version:
+            return
+        table = self.build(response.json())
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        table.to_parquet(tmp_path)
+        os.replace(tmp_path, self._table_path(version))
+        self._write_pointer(
+            {
+                "version": version,
+                "build_version": self.build_version,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            }
+        )
+        self._swap(version, table)
+        self._remove_old_versions()
+        logging.info(f"Snapshot {self.name}: version {version}, {len(table)} rows")
+
+    def _swap(self, version: str, table: geopandas.GeoDataFrame):
+        with self._lock:
+            self._version = version
+            self._table = table
+
+    def _write_pointer(self, pointer: dict):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as tmp:
+            json.dump(pointer, tmp)
+        os.replace(tmp_path, self._pointer_path)
+
+    def _remove_old_versions(self):
+        prefix = f"{self.name}-"
+        versions = sorted(
+            (entry.stat().st_mtime, entry.path)
+            for entry in os.scandir(self.directory)
+            if entry.name.startswith(prefix) and entry.name.endswith(".parquet")
+        )
+        for _, path in versions[:-SNAPSHOT_VERSIONS_KEPT]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,20 @@
+import json
+from typing import List
+
+import requests.utils
+
+from domain.api import api
+
+VEHICLE_DISTANCE_COMPONENT = "stib_vehicle_distance_parquetize"
+
+
+def list_parquet_files(
+    line_id: str, min_timestamp: int, max_timestamp: int
+) -> List[str]:
+    # Remote urls of the vehicle distance files of a line between two unix timestamps
+    keys = {"lineId": line_id}
+    keys_url = requests.utils.quote(json.dumps(keys))
+    response = api.get_json(
+        f"/parquetized?start_timestamp={min_timestamp}&end_timestamp={max_timestamp}&component={VEHICLE_DISTANCE_COMPONENT}&keys={keys_url}"
+    )
+    return response["results"]
@@ -0,0 +1,67 @@
+from typing import Dict, List
+
+import pandas as pd
+
+
+class LineDirection:
+    """Ordered segments (interstops) of one direction of a line."""
+
+    __slots__ = ("line_id", "direction", "terminus", "segment_names", "_segment_index")
+
+    def __init__(
+        self, line_id: str, direction, terminus: str, segment_names: List[str]
+    ):
+        self.line_id = line_id
+        self.direction = direction
+        self.terminus = terminus
+        self.segment_names = segment_names
+        # Name -> position of its first segment
+        self._segment_index = {}
+        for i, name in enumerate(segment_names):
+            self._segment_index.setdefault(name, i)
+
+    def segment_index(self, segment_name: str) -> int:
+        return self._segment_index[segment_name]
+
+
+class Topology:
+    """Lines, directions and stops of the network, built once from ``get_stops``.
+
+    Holds the stop id -> name map, the ordered segments of each (line, direction)
+    and the terminus of each direction, every lookup is a dict access instead of a
+    scan of the stops dataframe.
+    """
+
+    __slots__ = ("line_ids", "_stop_names", "_line_directions", "_directions")
+
+    def __init__(self, stops: pd.DataFrame, line_ids: List[str]):
+        self.line_ids = list(line_ids)
+        # First name of each stop id, like a lookup of the first matching row
+        self._stop_names: Dict[int, str] = {}
+        for stop_id, stop_name in zip(stops["stop_id"], stops["stop_name"]):
+            self._stop_names.setdefault(int(stop_id), stop_name)
+
+        self._line_directions: Dict[tuple, LineDirection] = {}
+        # Line -> terminus name -> direction, in the order the directions appear
+        self._directions: Dict[str, Dict[str, object]] = {}
+        for (line_id, direction), line_stops in stops.groupby(
+            ["lineId", "direction"], sort=False
+        ):
+            terminus = line_stops.sort_values(by="stop_sequence")["stop_name"].iloc[-1]
+            self._line_directions[(line_id, direction)] = LineDirection(
+                line_id, direction, terminus, list(line_stops["segment_name"].values)
+            )
+            self._directions.setdefault(line_id, {})[terminus] = direction
+
+    def stop_name(self, stop_id) -> str:
+        try:
+            return self._stop_names[int(stop_id)]
+        except (KeyError, ValueError):
+            return f"Stop ID {stop_id}"
+
+    def directions(self, line_id: str) -> Dict[str, object]:
+        # Terminus name -> direction id of the line
+        return self._directions.get(line_id, {})
+
+    def line_direction(self, line_id: str, direction) -> LineDirection:
+        return self._line_directions[(line_id, direction)]
@@ -0,0 +1,145 @@
+import argparse
+import logging
+import os
+import shutil
+import uuid
+from datetime import datetime
+from typing import List, Optional
+from zoneinfo import ZoneInfo
+
+from domain.calendar_dimension import register_calendar
+from domain.config import WAREHOUSE_DIRECTORY
+from domain.database import database
+from domain.parquet_cache import parquet_cache
+from domain.sources import list_parquet_files
+
+BRUSSELS = ZoneInfo("Europe/Brussels")
+# Written in each partition once it is complete, holds the local datetime the data goes up to
+COVERAGE_FILE = "_COVERAGE"
+
+
+def month_bounds(month: str) -> tuple[datetime, datetime]:
+    year, month_index = map(int, month.split("-"))
+    start = datetime(year, month_index, 1)
+    end = datetime(year + month_index // 12, month_index % 12 + 1, 1)
+    return start, end
+
+
+def months_between(start: datetime, end: datetime) -> List[str]:
+    months = []
+    year, month_index = start.year, start.month
+    while (year, month_index) <= (end.year, end.month):
+        months.append(f"{year:04d}-{month_index:02d}")
+        year, month_index = year + month_index // 12, month_index % 12 + 1
+    return months
+
+
+def partition_directory(line_id: str, month: str) -> str:
+    return os.path.join(WAREHOUSE_DIRECTORY, f"lineId={line_id}", f"month={month}")
+
+
+def partition_coverage(line_id: str, month: str) -> Optional[datetime]:
+    try:
+        with open(os.path.join(partition_directory(line_id, month), COVERAGE_FILE)) as f:
+            return datetime.fromisoformat(f.read().strip())
+    except FileNotFoundError:
+        return None
+
+
+def warehouse_files_for(
+    line_id: str, start_datetime: datetime, end_datetime: datetime
+) -> Optional[List[str]]:
+    # Parquet globs covering the local datetime range, None if any part is not ingested
+    files = []
+    for month in months_between(start_datetime, end_datetime):
+        coverage = partition_coverage(line_id, month)
+        if coverage is None or coverage < min(end_datetime, month_bounds(month)[1]):
+            return None
+        files.append(os.path.join(partition_directory(line_id, month), "*.parquet"))
+    return files
+
+
+def ingest_month(line_id: str, month: str):
+    start, end = month_bounds(month)
+    # The current month is ingested up to now and can be ingested again later on
+    end = min(end, datetime.now().replace(minute=0, second=0, microsecond=0))
+
+    remote_files = list_parquet_files(
+        line_id,
+        int(start.replace(tzinfo=BRUSSELS).timestamp()),
+        int(end.replace(tzinfo=BRUSSELS).timestamp()),
+    )
+    if not remote_files:
+        logging.warning(f"No data for line {line_id} in {month}")
+        return
+
+    parquet_files = ",".join(
+        map(lambda x: f"'{x}'", parquet_cache.localize(remote_files))
+    )
+
+    staging_directory = os.path.join(WAREHOUSE_DIRECTORY, f".staging-{uuid.uuid4().hex}")
+    os.makedirs(staging_directory)
+
+    # Sorted by (pointId, directionId, date) so that the lag() windows of the speed query
+    # run on already ordered data, the low cardinality string columns end up dictionary encoded
+    query = f"""COPY (
+        WITH entries AS (
+            SELECT pointId, directionId, distanceFromPoint, date,
+                (date AT TIME ZONE 'UTC' AT TIME ZONE 'Europe/Brussels')::timestamp AS local_date
+            FROM read_parquet([{parquet_files}])
+            WHERE lineId = '{line_id}'
+        )
+        SELECT
+            pointId,
+            directionId,
+            distanceFromPoint,
+            date,
+            local_date,
+            hour(local_date)::UTINYINT AS local_hour,
+            dayofweek(local_date)::UTINYINT AS local_dow,
+            coalesce(calendar.DAY_TYPE, 'UNKNOWN') AS day_type
+        FROM entries
+        LEFT JOIN calendar ON calendar.CALENDAR_DATE::DATE = local_date::DATE
+        WHERE local_date >= '{start}' AND local_date < '{end}'
+        ORDER BY pointId, directionId, date
+    ) TO '{os.path.join(staging_directory, "data_0.parquet")}' (FORMAT PARQUET, COMPRESSION ZSTD)
+    """
+    try:
+        con = database.cursor()
+        register_calendar(con)
+        con.execute(query)
+        with open(os.path.join(staging_directory, COVERAGE_FILE), "w") as f:
+            f.write(end.isoformat())
+
+        target = partition_directory(line_id, month)
+        if os.path.exists(target):
+            shutil.rmtree(target)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(staging_directory, target)
+    finally:
+        if os.path.exists(staging_directory):
+            shutil.rmtree(staging_directory)
+
+    logging.info(f"Ingested line {line_id} for {month} up to {end}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Re-encode the vehicle distance data of a line into the local warehouse"
+    )
+    parser.add_argument("line_id")
+    parser.add_argument("start_month", help="First month to ingest, e.g. 2024-01")
+    parser.add_argument(
+        "end_month", nargs="?", help="Last month to ingest, defaults to start_month"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    start, _ = month_bounds(args.start_month)
+    end, _ = month_bounds(args.end_month or args.start_month)
+    for month in months_between(start, end):
+        ingest_month(args.line_id, month)
+
+
+if __name__ == "__main__":
+    main()
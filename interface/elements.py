@@ -1,7 +1,12 @@
 from typing import Any
 
+import altair as alt
 import streamlit as st
 
+from domain.governor import QueryCancelled
+from domain.helpers import speed_confidence_intervals
+from interface import text
+
 
 def card_number(title: str, value: Any, legend: str = None):
     st.markdown(
@@ -13,3 +18,47 @@ def card_number(title: str, value: Any, legend: str = None):
         + "</div>",
         unsafe_allow_html=True,
     )
+
+
+def approximate_speed_chart(results, fraction: float):
+    # Speed per interstop with its confidence interval while only part of the days is computed
+    intervals = speed_confidence_intervals(results)
+    intervals["low"] = intervals["speed"] - intervals["speed_ci"]
+    intervals["high"] = intervals["speed"] + intervals["speed_ci"]
+    color = (
+        alt.Color("period:N") if "period" in intervals.columns else alt.value("#4c78a8")
+    )
+    base = alt.Chart(intervals.sort_values("stop_sequence")).encode(
+        x=alt.X("segment", title="Segment", sort=None)
+    )
+    st.markdown(
+        f"Preview on {fraction:.0%} of the days, refining toward the exact figures..."
+    )
+    st.altair_chart(
+        base.mark_point(filled=True).encode(
+            y=alt.Y("speed", title="Average speed (km/h)"),
+            color=color,
+            tooltip=["segment", "speed", "speed_ci", "days"],
+        )
+        + base.mark_errorbar().encode(
+            y=alt.Y("low", title="Average speed (km/h)"), y2="high", color=color
+        ),
+        use_container_width=True,
+    )
+
+
+def queue_position_notice(placeholder, position: int):
+    placeholder.info(f"Waiting for a free slot, position {position} in line...")
+
+
+def analysis_error(error: BaseException):
+    # Stopped analyses (time or memory budget) are explained, other errors shown as is
+    if isinstance(error, QueryCancelled):
+        if error.reason == "timeout":
+            st.warning(text.QUERY_TIMEOUT)
+        elif error.reason == "memory":
+            st.warning(text.QUERY_MEMORY)
+        else:
+            st.warning(text.QUERY_CANCELLED)
+    else:
+        st.exception(error)
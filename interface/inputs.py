@@ -5,6 +5,7 @@ import streamlit as st
 
 from domain.helpers import get_excluded_dates_as_period
 from domain.query import SpeedComputationMode
+from domain.topology import LineDirection, Topology
 from interface import text
 
 
@@ -24,6 +25,22 @@ def speed_input():
     return selected_compute
 
 
+def superset_input():
+    return st.checkbox(
+        "Compute all hours and days once, then narrow hours, days and excluded periods instantly",
+        help="The first query is longer, the following ones on the same line, segments and dates "
+        "are filtered in memory. Speeds at the very edges of the selected hours may differ slightly.",
+    )
+
+
+def approximate_input():
+    return st.checkbox(
+        "Show an approximate preview first",
+        help="A sample of the days is computed first and shown with confidence intervals, "
+        "it is refined until every day is computed and the exact results are displayed.",
+    )
+
+
 def excluded_period_inputs(periods: List[tuple[datetime, datetime]]):
     st.markdown(
         "---\n*Please select the different periods you want to exclude from the analysis, for instance holidays. This is **not mandatory**.*\n"
@@ -191,54 +208,37 @@ def hour_inputs():
     return end_hour, start_hour
 
 
-def segment_inputs(direction_id, filtered_stops):
-    filtered_stops = (
-        filtered_stops[filtered_stops["direction"] == direction_id]
-        .copy()
-        .reset_index(drop=True)
-    )
+def segment_inputs(line_direction: LineDirection):
+    segment_names = line_direction.segment_names
     st.markdown(
         "---\n*Please select the start and end interstop. Note that interstops  between start and end are included, "
         "for one single segment, select the same start and end.*\n"
     )
     start_segment_name = st.selectbox(
         "Select the index of the start segment:",
-        filtered_stops["segment_name"].values,
+        segment_names,
         index=0,
     )
     stop_segment_name = st.selectbox(
         "Select the index of the end segment:",
-        filtered_stops["segment_name"].values,
-        index=len(filtered_stops["stop_name"].values) - 1,
-    )
-    start_segment_index = filtered_stops[
-        filtered_stops["segment_name"] == start_segment_name
-    ].index[0]
-    end_segment_index = (
-        filtered_stops[filtered_stops["segment_name"] == stop_segment_name].index[0] - 1
+        segment_names,
+        index=len(segment_names) - 1,
     )
+    start_segment_index = line_direction.segment_index(start_segment_name)
+    end_segment_index = line_direction.segment_index(stop_segment_name) - 1
     return end_segment_index, start_segment_index
 
 
-def line_and_direction_inputs(line_ids, stops):
+def line_and_direction_inputs(topology: Topology):
     col1, col2 = st.columns([1, 2])
     # Input fields
     with col1:
-        line_name = col1.selectbox("Line", line_ids, index=list(line_ids).index("60"))
-    # Filter stops dataframe based on line selection
-    filtered_stops = stops[stops["lineId"] == line_name]
-    # Get unique directions for the selected line
-    unique_directions = filtered_stops["direction"].unique()
-    unique_directions_names = {}
-    for direction in unique_directions:
-        last_stop_name = (
-            filtered_stops[filtered_stops["direction"] == direction]
-            .sort_values(by="stop_sequence")["stop_name"]
-            .values[-1]
+        line_name = col1.selectbox(
+            "Line", topology.line_ids, index=topology.line_ids.index("60")
         )
-
-        unique_directions_names[last_stop_name] = direction
+    # Directions of the selected line, named after their terminus
+    unique_directions_names = topology.directions(line_name)
     with col2:
         direction_name = st.selectbox(f"Direction", unique_directions_names.keys())
     direction_id = unique_directions_names[direction_name]
-    return direction_id, filtered_stops, line_name
+    return direction_id, topology.line_direction(line_name, direction_id), line_name
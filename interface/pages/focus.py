@@ -3,16 +3,35 @@ from datetime import datetime
 from typing import Any
 
 import altair as alt
-import pandas as pd
 import streamlit as st
 
-from domain.helpers import build_results, retrieve_stops_and_lines
+from domain.helpers import (
+    build_results,
+    iter_build_results,
+    get_topology,
+    retrieve_stops_and_lines,
+    select_results_speed_computation_mode,
+)
+from domain.governor import governor
+from domain.jobs import job_runner
+from domain.result_store import result_store
 from interface import inputs, text
+from interface.elements import (
+    analysis_error,
+    approximate_speed_chart,
+    queue_position_notice,
+)
+from interface.session import current_session_id
 import geopandas as gpd
 import pydeck as pdk
 import json
 
 from interface.plot_map import plot_map
+from interface.view_models import (
+    focus_comparison_view,
+    focus_period_view,
+    sort_for_views,
+)
 
 
 def _set_default(key: str, value: Any):
@@ -40,26 +59,26 @@ def focus_view():
         unsafe_allow_html=True,
     )
 
-    stops, line_ids = retrieve_stops_and_lines()
+    stops, _ = retrieve_stops_and_lines()
+    topology = get_topology()
 
     defaults = {
         "periods_count": 1,
         "excluded_periods_count": 0,
-        "periods_results": [],
-        "periods_results_light": [],
+        "results_periods_count": 0,
+        "job": None,
+        "job_error": None,
     }
 
     for k, v in defaults.items():
         _set_default(k, v)
 
-    direction_id, filtered_stops, line_name = inputs.line_and_direction_inputs(
-        line_ids, stops
+    direction_id, line_direction, line_name = inputs.line_and_direction_inputs(
+        topology
     )
 
     # Filter stops dataframe based on direction selection
-    end_segment_index, start_segment_index = inputs.segment_inputs(
-        direction_id, filtered_stops
-    )
+    end_segment_index, start_segment_index = inputs.segment_inputs(line_direction)
 
     end_hour, start_hour = inputs.hour_inputs()
 
@@ -71,6 +90,10 @@ def focus_view():
 
     selected_compute = inputs.speed_input()
 
+    superset = inputs.superset_input()
+
+    approximate = inputs.approximate_input()
+
     st.markdown("---")
 
     # Submit button
@@ -82,23 +105,42 @@ def focus_view():
             excluded_periods,
             line_name,
             periods,
-            selected_compute,
             selected_days_human_index,
             start_hour,
             start_segment_index,
             stops,
+            superset,
+            approximate,
+            selected_compute,
         )
 
-    if st.session_state.periods_results:
-        display_results(end_segment_index, start_segment_index)
-
-
-@st.cache_data
-def convert_df(df):
-    return df.to_csv(index=False).encode("utf-8")
+    if st.session_state.job is not None:
+        job_status()
+    if st.session_state.job_error is not None:
+        analysis_error(st.session_state.job_error)
+        st.session_state.job_error = None
+
+    # Every mode is computed on submit, switching mode only narrows the stored results
+    session_id = current_session_id()
+    if result_store.version(session_id, "focus") is not None:
+        display_results(
+            session_id,
+            selected_compute,
+            st.session_state.results_periods_count,
+            end_segment_index,
+            start_segment_index,
+        )
 
 
-def display_results(end_segment_index, start_segment_index):
+def display_results(
+    session_id,
+    selected_compute,
+    periods_count,
+    end_segment_index,
+    start_segment_index,
+):
+    # The datasets of the charts come from the view models of the stored results, a
+    # rerun with the same results and options does not compute them again
     st.divider()
     st.title("Results")
     st.markdown(
@@ -120,23 +162,17 @@ def display_results(end_segment_index, start_segment_index):
         index=len(available_periods) - 1,
     )
     # Display results for each selected period.
-    for i, (results, results_light) in enumerate(
-        zip(st.session_state.periods_results, st.session_state.periods_results_light)
-    ):
+    for i in range(periods_count):
         if available_periods.index(selected_period) != i:
             continue
+        view = focus_period_view(session_id, selected_compute, i + 1)
+        if view is None:
+            return
 
         # Extract the selected period's start and end dates.
         start_date = st.session_state[f"start_date_{i}"]
         end_date = st.session_state[f"end_date_{i}"]
 
-        # Process results for better visualization.
-        aggregated_results = (
-            results.groupby(["stop_sequence", "segment"])
-            .agg(avg_speed=("speed", "median"), total_time=("time", "median"))
-            .reset_index()
-        )
-
         # Display results for the selected period.
         st.subheader(f"Results for Period {i + 1} ({start_date} - {end_date})")
         st.markdown(
@@ -149,16 +185,9 @@ def display_results(end_segment_index, start_segment_index):
         with tab_chart:
             # Average speed per hour.
             tab_chart.markdown("Average speed/hour for the selected segment.")
-            hourly_results = results[["date", "speed"]].copy()
-            hourly_results["hour"] = pd.to_datetime(hourly_results["date"]).dt.hour
-            avg_speed_per_hour = (
-                hourly_results.groupby("hour")
-                .agg(avg_speed=("speed", "mean"))
-                .reset_index()
-            )
             # equivalent with altair
             chart = (
-                alt.Chart(avg_speed_per_hour)
+                alt.Chart(view.hourly_speeds)
                 .mark_bar()
                 .encode(
                     x=alt.X("hour", title="Hour", type="ordinal"),
@@ -177,7 +206,7 @@ def display_results(end_segment_index, start_segment_index):
             tab_chart.markdown("Average speed per interstop  for the selected period.")
 
             chart = (
-                alt.Chart(aggregated_results)
+                alt.Chart(view.segment_speeds)
                 .mark_bar()
                 .encode(
                     x=alt.X("segment", title="Segment", sort=None),
@@ -196,17 +225,14 @@ def display_results(end_segment_index, start_segment_index):
             # Map of average speed per interstop .
             tab_chart.markdown("Average speed per interstop  (Map).")
 
-            plot_map(results)
+            plot_map(view.map_geojson)
 
             # Average time per interstop .
             tab_chart.markdown("Average time per interstop  for the selected period.")
-            aggregated_results = aggregated_results.replace(
-                [float("inf"), -float("inf")], float("nan")
-            ).dropna()
 
             # with altair
             chart = (
-                alt.Chart(aggregated_results)
+                alt.Chart(view.segment_times)
                 .mark_bar()
                 .encode(
                     x=alt.X("segment", title="Segment", sort=None),
@@ -229,17 +255,16 @@ def display_results(end_segment_index, start_segment_index):
         with tab_data:
             tab_data.markdown(text.RAW_DATA)
             tab_data.dataframe(
-                results_light[
-                    [
-                        "count",
-                        "stop_name",
-                        "prev_stop_name",
-                        "segment",
-                        "stop_sequence",
-                        "date",
-                        "time",
-                        "speed",
-                    ]
+                view.results_light,
+                column_order=[
+                    "count",
+                    "stop_name",
+                    "prev_stop_name",
+                    "segment",
+                    "stop_sequence",
+                    "date",
+                    "time",
+                    "speed",
                 ],
                 column_config={
                     "speed": "Speed (km/h)",
@@ -252,39 +277,31 @@ def display_results(end_segment_index, start_segment_index):
                     "segment": "Segment",
                 },
             )
-            tab_data.download_button(
-                "Download data as CSV",
-                convert_df(results_light),
-                f"results_{start_segment_index}_{end_segment_index}_{start_date}_{end_date}.csv",
-            )
+            # The CSV of the displayed period and mode is only built on request
+            if tab_data.button("Prepare the CSV download"):
+                tab_data.download_button(
+                    "Download data as CSV",
+                    view.csv(),
+                    f"results_{start_segment_index}_{end_segment_index}_{start_date}_{end_date}.csv",
+                )
             tab_data.subheader("Results per stop_name:")
-            tab_data.write(aggregated_results)
+            tab_data.write(view.segment_times)
 
     # Display comparison results across all periods if selected.
-    if st.session_state.periods_results and selected_period == "Comparison between all":
+    if selected_period == "Comparison between all":
         st.header("Results for All Periods")
 
-        # Concatenate results and assign period numbers.
-        concatenated_results = pd.concat(
-            [
-                result.assign(period=str(i + 1))
-                for i, result in enumerate(st.session_state.periods_results)
-            ]
-        )
+        # Results of every period, they are already tagged with their period number.
+        view = focus_comparison_view(session_id, selected_compute)
+        if view is None:
+            return
 
         # Average speed per hour across periods.
         st.subheader("Average speed/hour for the complete segment for each period.")
-        hourly_results = concatenated_results[["date", "speed", "period"]].copy()
-        hourly_results["hour"] = pd.to_datetime(hourly_results["date"]).dt.hour
-        avg_speed_per_hour = (
-            hourly_results.groupby(["hour", "period"])
-            .agg(avg_speed=("speed", "mean"))
-            .reset_index()
-        )
 
         # Equivalent with altair
         chart = (
-            alt.Chart(avg_speed_per_hour)
+            alt.Chart(view.hourly_speeds)
             .mark_line()
             .encode(
                 x=alt.X("hour", title="Hour", type="ordinal"),
@@ -293,24 +310,13 @@ def display_results(end_segment_index, start_segment_index):
                     title="Average speed (km/h)",
                     scale=alt.Scale(domain=[0, 20]),
                 ),
-                color=alt.Color("period"),
+                color=alt.Color("period:N"),
                 tooltip=["hour", "avg_speed"],
             )
         )
 
         st.altair_chart(chart, use_container_width=True)
-        concatenated_results["segment"] = (
-            concatenated_results["prev_stop_name"]
-            + " -> "
-            + concatenated_results["stop_name"]
-        )
         # Average speed per interstop  across periods.
-        aggregated_results = (
-            concatenated_results.groupby(["segment", "period", "stop_sequence"])
-            .agg(avg_speed=("speed", "mean"), total_time=("time", "mean"))
-            .reset_index()
-        )
-
         st.subheader(
             "Average speed/interstop  for the selected period across all periods."
         )
@@ -318,12 +324,12 @@ def display_results(end_segment_index, start_segment_index):
         # Plot results based on interstop selection.
         if start_segment_index == end_segment_index:
             st.scatter_chart(
-                aggregated_results, x="segment", y="avg_speed", color="period"
+                view.segment_speeds, x="segment", y="avg_speed", color="period"
             )
         else:
             # with altair
             chart = (
-                alt.Chart(aggregated_results.sort_values("stop_sequence"))
+                alt.Chart(view.segment_speeds)
                 .mark_line()
                 .encode(
                     x=alt.X("segment", title="Segment", sort=None),
@@ -332,7 +338,7 @@ def display_results(end_segment_index, start_segment_index):
                         title="Average speed (km/h)",
                         sort=None,
                     ),
-                    color=alt.Color("period"),
+                    color=alt.Color("period:N"),
                     tooltip=["segment", "avg_speed"],
                 )
                 .properties(height=500)
@@ -348,19 +354,77 @@ def fetch_and_compute(
     excluded_periods,
     line_name,
     periods,
-    selected_compute,
     selected_days_human_index,
     start_hour,
     start_segment_index,
     stops,
+    superset,
+    approximate=False,
+    selected_compute=None,
 ):
-    st.session_state.periods_results = []
-    st.session_state.periods_results_light = []
-    for period_start, period_end in periods:
+    result_store.remove(current_session_id(), "focus")
+    st.session_state.job = None
+    if not approximate and job_runner.enabled:
+        # Computed by the worker processes, the page polls the job with job_status
+        st.session_state.job = job_runner.submit(
+            stops,
+            line_name,
+            direction_id,
+            selected_days_human_index,
+            start_hour,
+            end_hour,
+            None,
+            None,
+            start_segment_index,
+            end_segment_index,
+            excluded_periods,
+            periods=periods,
+            superset=superset,
+            session_id=current_session_id(),
+        )
+        st.session_state.job_periods_count = len(periods)
+        return
+
+    queue_notice = st.empty()
+    try:
+        with st.spinner("Wait for it..."), governor.session(
+            current_session_id(),
+            on_wait=lambda position: queue_position_notice(queue_notice, position),
+        ):
+            fetch_start = datetime.now()
+            # All the periods are fetched and scanned at once
+            if approximate:
+                preview = st.empty()
+                for fraction, results in iter_build_results(
+                    stops,
+                    line_name,
+                    direction_id,
+                    selected_days_human_index,
+                    start_hour,
+                    end_hour,
+                    start_segment_index,
+                    end_segment_index,
+                    excluded_periods,
+                    periods,
+                    superset=superset,
+                ):
+                    if fraction < 1:
+                        with preview.container():
+                            approximate_speed_chart(
+                                select_results_speed_computation_mode(
+                                    results, selected_compute
+                                ),
+                                fraction,
+                            )
+                preview.empty()
+            else:
+                progress_bar = st.progress(0.0)
+
+                def report_progress(done, total):
+                    progress_bar.progress(
+                        done / total, text=f"{done}/{total} disjoint period(s) computed"
+                    )
 
-        try:
-            with st.spinner("Wait for it..."):
-                fetch_start = datetime.now()
                 results = build_results(
                     stops,
                     line_name,
@@ -368,36 +432,52 @@ def fetch_and_compute(
                     selected_days_human_index,
                     start_hour,
                     end_hour,
-                    period_start,
-                    period_end,
+                    None,
+                    None,
                     start_segment_index,
                     end_segment_index,
                     excluded_periods,
-                    selected_compute,
-                )
-                time_elapsed = datetime.now() - fetch_start
-                st.success(
-                    f"Analysis completed in {int(time_elapsed.total_seconds())} seconds, Period ({period_start} - {period_end})"
+                    None,
+                    periods=periods,
+                    superset=superset,
+                    progress=report_progress,
                 )
-            results = results.sort_values(by="stop_sequence")
-            results["segment"] = (
-                results["prev_stop_name"] + " -> " + results["stop_name"]
+                progress_bar.empty()
+            time_elapsed = datetime.now() - fetch_start
+            st.success(
+                f"Analysis completed in {int(time_elapsed.total_seconds())} seconds, {len(periods)} period(s)"
             )
+        store_results(results, len(periods))
+    except Exception as e:
+        analysis_error(e)
+    finally:
+        queue_notice.empty()
+
+
+def store_results(results, periods_count):
+    # One copy of the results (every mode) per session, held by the result store
+    result_store.put(current_session_id(), "focus", sort_for_views(results))
+    st.session_state.results_periods_count = periods_count
+
+
+@st.fragment(run_every=1)
+def job_status():
+    job = st.session_state.job
+    if job is None:
+        return
+    if not job.done():
+        position = job_runner.queue_position(job)
+        if position is not None:
+            st.info(f"Analysis queued, position {position} in line...")
+        else:
+            st.info(f"Analysis {job.status} for {int(job.elapsed)} seconds...")
+        return
+
+    st.session_state.job = None
+    if job.status == "failed":
+        st.session_state.job_error = job.future.exception()
+    else:
+        store_results(job.result(), st.session_state.job_periods_count)
+    # The whole page is drawn again with the results
+    st.rerun()
 
-            st.session_state.periods_results.append(results)
-            st.session_state.periods_results_light.append(
-                results[
-                    [
-                        "count",
-                        "stop_name",
-                        "segment",
-                        "prev_stop_name",
-                        "stop_sequence",
-                        "date",
-                        "time",
-                        "speed",
-                    ]
-                ]
-            )
-        except Exception as e:
-            st.exception(e)
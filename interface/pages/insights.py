@@ -4,12 +4,24 @@ import altair as alt
 import streamlit as st
 
 from domain.helpers import (
+    get_topology,
     retrieve_stops_and_lines,
     build_results,
-    remove_speed_outliers,
+    iter_build_results,
+    select_results_speed_computation_mode,
 )
+from domain.governor import governor
+from domain.jobs import job_runner
+from domain.result_store import result_store
 from interface import inputs
+from interface.elements import (
+    analysis_error,
+    approximate_speed_chart,
+    queue_position_notice,
+)
 from interface.plot_map import plot_map
+from interface.session import current_session_id
+from interface.view_models import insights_view_model
 
 
 def _set_default(key: str, value: Any):
@@ -17,10 +29,114 @@ def _set_default(key: str, value: Any):
         setattr(st.session_state, key, value)
 
 
+@st.fragment(run_every=1)
+def job_status():
+    job = st.session_state.get("insights_job")
+    if job is None:
+        return
+    if not job.done():
+        position = job_runner.queue_position(job)
+        if position is not None:
+            st.info(f"Analysis queued, position {position} in line...")
+        else:
+            st.info(
+                f"Crunching through millions of data points... ({int(job.elapsed)}s)"
+            )
+        return
+
+    st.session_state["insights_job"] = None
+    if job.status == "failed":
+        st.session_state["insights_job_error"] = job.future.exception()
+    else:
+        result_store.put(current_session_id(), "insights", job.result())
+    # The whole page is drawn again with the results
+    st.rerun()
+
+
+def compute_insights(
+    stops,
+    line_name,
+    direction_id,
+    selected_days_human_index,
+    start_hour,
+    end_hour,
+    period_start,
+    period_end,
+    start_segment_index,
+    end_segment_index,
+    excluded_periods,
+    selected_compute,
+    superset,
+    approximate,
+):
+    if approximate:
+        preview = st.empty()
+        for fraction, results in iter_build_results(
+            stops,
+            line_name,
+            direction_id,
+            selected_days_human_index,
+            start_hour,
+            end_hour,
+            start_segment_index,
+            end_segment_index,
+            excluded_periods,
+            [(period_start, period_end)],
+            superset=superset,
+        ):
+            if fraction < 1:
+                with preview.container():
+                    approximate_speed_chart(
+                        select_results_speed_computation_mode(
+                            results, selected_compute
+                        ),
+                        fraction,
+                    )
+        preview.empty()
+        result_store.put(current_session_id(), "insights", results)
+    elif job_runner.enabled:
+        # Computed by the worker processes, the page polls the job with job_status
+        st.session_state["insights_job"] = job_runner.submit(
+            stops,
+            line_name,
+            direction_id,
+            selected_days_human_index,
+            start_hour,
+            end_hour,
+            period_start,
+            period_end,
+            start_segment_index,
+            end_segment_index,
+            excluded_periods,
+            superset=superset,
+            session_id=current_session_id(),
+        )
+    else:
+        with st.spinner("Crunching through millions of data points..."):
+            # Every mode is kept, switching mode does not compute again
+            results = build_results(
+                stops,
+                line_name,
+                direction_id,
+                selected_days_human_index,
+                start_hour,
+                end_hour,
+                period_start,
+                period_end,
+                start_segment_index,
+                end_segment_index,
+                excluded_periods,
+                None,
+                superset=superset,
+            )
+        result_store.put(current_session_id(), "insights", results)
+
+
 def insights_view():
     st.header("STIB Insights")
 
-    stops, line_ids = retrieve_stops_and_lines()
+    stops, _ = retrieve_stops_and_lines()
+    topology = get_topology()
 
     defaults = {
         "periods_count": 1,
@@ -30,14 +146,12 @@ def insights_view():
     for k, v in defaults.items():
         _set_default(k, v)
 
-    direction_id, filtered_stops, line_name = inputs.line_and_direction_inputs(
-        line_ids, stops
+    direction_id, line_direction, line_name = inputs.line_and_direction_inputs(
+        topology
     )
 
     # Filter stops dataframe based on direction selection
-    end_segment_index, start_segment_index = inputs.segment_inputs(
-        direction_id, filtered_stops
-    )
+    end_segment_index, start_segment_index = inputs.segment_inputs(line_direction)
 
     end_hour, start_hour = inputs.hour_inputs()
 
@@ -51,11 +165,19 @@ def insights_view():
 
     selected_compute = inputs.speed_input()
 
+    superset = inputs.superset_input()
+
+    approximate = inputs.approximate_input()
+
     if st.button("Compute"):
-        with st.spinner("Crunching through millions of data points..."):
-            st.session_state["results"] = None
-            results = remove_speed_outliers(
-                build_results(
+        result_store.remove(current_session_id(), "insights")
+        queue_notice = st.empty()
+        try:
+            with governor.session(
+                current_session_id(),
+                on_wait=lambda position: queue_position_notice(queue_notice, position),
+            ):
+                compute_insights(
                     stops,
                     line_name,
                     direction_id,
@@ -68,43 +190,42 @@ def insights_view():
                     end_segment_index,
                     excluded_periods,
                     selected_compute,
+                    superset,
+                    approximate,
                 )
-            )
-            st.session_state["results"] = results
+        except Exception as e:
+            analysis_error(e)
+        finally:
+            queue_notice.empty()
 
-    if st.session_state.get("results") is not None:
-        results = st.session_state["results"]
-
-        average_speed_overall = results["speed"].mean()
+    if st.session_state.get("insights_job") is not None:
+        job_status()
+    if st.session_state.get("insights_job_error") is not None:
+        analysis_error(st.session_state["insights_job_error"])
+        st.session_state["insights_job_error"] = None
 
+    session_id = current_session_id()
+    # Computed once per stored results and mode, see interface.view_models
+    view = insights_view_model(session_id, selected_compute)
+    if view is not None:
         st.metric(
             "Average speed",
-            f"{average_speed_overall:0.2f}",
+            f"{view.average_speed:0.2f}",
             help="Expressed in km/h",
         )
 
         # Plot average speed per month
         st.write("### Average speed per month")
-        # set date as index
-        results.set_index("date", inplace=True, drop=False)
         st.line_chart(
-            results["speed"].resample("ME").mean(),
+            view.monthly_speeds,
             x_label="Month",
             y_label="Average speed (km/h)",
         )
 
         # Average speed per day of the week
         st.write("### Average speed per day of the week")
-        results["day_of_week"] = (results.index.day_of_week + 1).astype(str)
-        results["day_of_week_name"] = (results.index.day_name()).astype(str)
-
-        df_per_day_of_the_week = (
-            results.groupby(["day_of_week", "day_of_week_name"])[["speed"]]
-            .mean()
-            .reset_index()
-        )
         st.altair_chart(
-            alt.Chart(df_per_day_of_the_week)
+            alt.Chart(view.day_of_week_speeds)
             .mark_bar()
             .encode(
                 x=alt.X("day_of_week_name", title="Day of the week", sort=None),
@@ -117,11 +238,7 @@ def insights_view():
         st.write("### Boxplot of speed per day of the week")
 
         st.altair_chart(
-            alt.Chart(
-                results[["day_of_week_name", "day_of_week", "speed"]]
-                .copy()
-                .sort_values("day_of_week")
-            )
+            alt.Chart(view.day_of_week_boxplot)
             .mark_boxplot()
             .encode(
                 x=alt.X("day_of_week_name", title="Day of the week", sort=None),
@@ -132,11 +249,10 @@ def insights_view():
 
         # Boxplot of speed per hour
         st.write("### Boxplot of speed per hour")
-        results["hour"] = results.index.hour
         st.bar_chart(
-            results.groupby("hour")["speed"].mean(),
+            view.hourly_speeds,
             x_label="Hour",
             y_label="Average speed (km/h)",
         )
 
-        plot_map(results)
+        plot_map(view.map_geojson)
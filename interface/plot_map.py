@@ -7,15 +7,19 @@ import streamlit as st
 from interface import text
 
 
-def plot_map(results):
+def speed_map_geojson(results) -> dict:
+    # Average speed of every interstop as GeoJSON features, see plot_map
     speed_map = (
-        results.groupby(["stop_name", "geometry_y"])
+        results.groupby(["stop_name", "geometry_y"], observed=True)
         .agg(avg_speed=("speed", "mean"))
         .reset_index()
         .rename(columns={"geometry_y": "geometry"})
     )
     gdf = gpd.GeoDataFrame(speed_map, geometry="geometry")
-    data = json.loads(gdf.to_json())
+    return json.loads(gdf.to_json())
+
+
+def plot_map(data: dict):
     geojson = pdk.Layer(
         "GeoJsonLayer",
         data,
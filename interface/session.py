@@ -0,0 +1,15 @@
+from typing import Optional
+
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+
+def current_session_id() -> Optional[str]:
+    # Streamlit session of the running script, None outside of a script run
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else None
+
+
+def is_session_active(session_id: str) -> bool:
+    # Without a server (bare mode) sessions are never considered gone
+    return not Runtime.exists() or Runtime.instance().is_active_session(session_id)
@@ -146,3 +146,7 @@ RAW_DATA = (
 
 
 FOCUS = "Here you can focus on a specific line and direction to analyze the speed of vehicles over a specific time period and specific interstops. You can also filter the data by time periods, days of the week, and exc  lude certain periods like holidays."
+
+QUERY_TIMEOUT = "The analysis took too long and was stopped, try with shorter periods or fewer hours."
+QUERY_MEMORY = "The analysis needed more memory than it is allowed to use, try with shorter periods or fewer hours."
+QUERY_CANCELLED = "The analysis was cancelled."
@@ -0,0 +1,259 @@
+import json
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from domain.helpers import (
+    remove_speed_outliers,
+    select_results_speed_computation_mode,
+    speed_column,
+)
+from domain.pipeline import SpeedComputationMode, count_column
+from domain.result_store import projection, result_store
+from interface.plot_map import speed_map_geojson
+
+# Columns of the Focus data tab and of its CSV download
+LIGHT_COLUMNS = [
+    "count",
+    "stop_name",
+    "segment",
+    "prev_stop_name",
+    "stop_sequence",
+    "date",
+    "time",
+    "speed",
+]
+# Columns of the stored results the period charts read, besides the speed and count
+PERIOD_COLUMNS = ["stop_name", "segment", "prev_stop_name", "stop_sequence", "date"]
+
+
+def sort_for_views(results: pd.DataFrame) -> pd.DataFrame:
+    # Order of the stored Focus results (every mode). The rows of a period are
+    # contiguous and so are, within a period, the rows with readings of each speed
+    # computation mode: a period view is a slice of the stored results. A reading
+    # greater than zero counts in the two other modes, the rows of a period are: no
+    # reading, ALL only, ALL and CLOSE_TO_STOP, GREATER_THAN_ZERO, CLOSE_TO_STOP only
+    has = {
+        mode: results[count_column(mode)].to_numpy() > 0
+        for mode in SpeedComputationMode
+    }
+    everything = has[SpeedComputationMode.ALL]
+    close = has[SpeedComputationMode.GREATER_THAN_ZERO_IF_CLOSE_TO_STOP]
+    readings = np.select(
+        [
+            ~(everything | close),
+            has[SpeedComputationMode.GREATER_THAN_ZERO],
+            everything & close,
+            everything,
+        ],
+        [0, 3, 2, 1],
+        4,
+    )
+    order = np.lexsort(
+        (
+            results["stop_sequence"].to_numpy(),
+            readings,
+            pd.Categorical(results["period"]).codes,
+        )
+    )
+    return results.iloc[order]
+
+
+def _period_rows(
+    results: pd.DataFrame, speed_computation_mode: SpeedComputationMode, period: int
+) -> pd.DataFrame:
+    # Rows of a period with readings of the mode, a slice (no copy) of the results
+    # ordered by sort_for_views
+    positions = np.flatnonzero(
+        (results["period"] == str(period)).to_numpy()
+        & (results[count_column(speed_computation_mode)].to_numpy() > 0)
+    )
+    if len(positions) == 0:
+        return results.iloc[:0]
+    if positions[-1] - positions[0] + 1 != len(positions):
+        # Counts breaking the nesting of the modes, the rows are copied
+        return results.iloc[positions]
+    return results.iloc[positions[0] : positions[-1] + 1]
+
+
+def _nbytes(*datasets) -> int:
+    # Memory of the datasets of a view model, counted in the result store budget
+    total = 0
+    for dataset in datasets:
+        if isinstance(dataset, pd.DataFrame):
+            total += int(dataset.memory_usage(deep=True).sum())
+        elif isinstance(dataset, pd.Series):
+            total += int(dataset.memory_usage(deep=True))
+        else:
+            # GeoJSON of a map
+            total += len(json.dumps(dataset))
+    return total
+
+
+class FocusPeriodView:
+    """Datasets of the charts and tables of one period of the Focus results."""
+
+    __slots__ = (
+        "results_light",
+        "hourly_speeds",
+        "segment_speeds",
+        "segment_times",
+        "map_geojson",
+        "nbytes",
+    )
+
+    def __init__(
+        self, rows: pd.DataFrame, speed_computation_mode: SpeedComputationMode
+    ):
+        # rows is a slice of the stored results (see _period_rows), the data tab shares
+        # its arrays, only the time and the aggregates are new
+        columns = {column: column for column in PERIOD_COLUMNS}
+        columns["speed"] = speed_column(speed_computation_mode)
+        columns["count"] = count_column(speed_computation_mode)
+        time = rows["delta_distance"] / (rows[columns["speed"]] / 3.6)
+        self.results_light = projection(
+            rows, {name: columns[name] for name in LIGHT_COLUMNS if name != "time"}
+        )
+        self.results_light.insert(LIGHT_COLUMNS.index("time"), "time", time)
+        results = projection(rows, {**columns, "geometry_y": "geometry_y"})
+        results["time"] = time
+        self.hourly_speeds = (
+            results.assign(hour=results["date"].dt.hour)
+            .groupby("hour")
+            .agg(avg_speed=("speed", "mean"))
+            .reset_index()
+        )
+        self.segment_speeds = (
+            results.groupby(["stop_sequence", "segment"], observed=True)
+            .agg(avg_speed=("speed", "median"), total_time=("time", "median"))
+            .reset_index()
+        )
+        self.segment_times = self.segment_speeds.replace(
+            [float("inf"), -float("inf")], float("nan")
+        ).dropna()
+        self.map_geojson = speed_map_geojson(results)
+        self.nbytes = _nbytes(
+            time,
+            self.hourly_speeds,
+            self.segment_speeds,
+            self.segment_times,
+            self.map_geojson,
+        )
+
+    def csv(self) -> bytes:
+        # Built on request only, it is not kept
+        return self.results_light.to_csv(index=False).encode("utf-8")
+
+
+class FocusComparisonView:
+    """Datasets of the comparison between the periods of the Focus results."""
+
+    __slots__ = ("hourly_speeds", "segment_speeds", "nbytes")
+
+    def __init__(self, results: pd.DataFrame):
+        self.hourly_speeds = (
+            results.assign(hour=results["date"].dt.hour)
+            .groupby(["hour", "period"], observed=True)
+            .agg(avg_speed=("speed", "mean"))
+            .reset_index()
+        )
+        self.segment_speeds = (
+            results.groupby(["segment", "period", "stop_sequence"], observed=True)
+            .agg(avg_speed=("speed", "mean"), total_time=("time", "mean"))
+            .reset_index()
+            .sort_values("stop_sequence")
+        )
+        self.nbytes = _nbytes(self.hourly_speeds, self.segment_speeds)
+
+
+class InsightsView:
+    """Datasets of the Insights charts, speed outliers removed."""
+
+    __slots__ = (
+        "average_speed",
+        "monthly_speeds",
+        "day_of_week_speeds",
+        "day_of_week_boxplot",
+        "hourly_speeds",
+        "map_geojson",
+        "nbytes",
+    )
+
+    def __init__(self, results: pd.DataFrame):
+        results = remove_speed_outliers(results)
+        self.average_speed = results["speed"].mean()
+        speeds = results.set_index("date")["speed"]
+        self.monthly_speeds = speeds.resample("ME").mean()
+        days = pd.DataFrame(
+            {
+                "day_of_week": (speeds.index.day_of_week + 1).astype(str),
+                "day_of_week_name": speeds.index.day_name().astype(str),
+                "speed": speeds.values,
+            }
+        )
+        self.day_of_week_speeds = (
+            days.groupby(["day_of_week", "day_of_week_name"])[["speed"]]
+            .mean()
+            .reset_index()
+        )
+        self.day_of_week_boxplot = days[
+            ["day_of_week_name", "day_of_week", "speed"]
+        ].sort_values("day_of_week")
+        self.hourly_speeds = speeds.groupby(speeds.index.hour).mean()
+        self.hourly_speeds.index.name = "hour"
+        self.map_geojson = speed_map_geojson(results)
+        self.nbytes = _nbytes(
+            self.monthly_speeds,
+            self.day_of_week_speeds,
+            self.day_of_week_boxplot,
+            self.hourly_speeds,
+            self.map_geojson,
+        )
+
+
+# View models are kept with the stored result they come from, see ResultStore.view:
+# they count in its memory budget and are dropped when it is spilled or replaced
+
+
+def focus_period_view(
+    session_id: Optional[str],
+    speed_computation_mode: SpeedComputationMode,
+    period: int,
+) -> Optional[FocusPeriodView]:
+    # period is the number (1, 2, ...) of one of the periods of the results
+    def build(results):
+        return FocusPeriodView(
+            _period_rows(results, speed_computation_mode, period),
+            speed_computation_mode,
+        )
+
+    return result_store.view(
+        session_id, "focus", ("period", speed_computation_mode, period), build
+    )
+
+
+def focus_comparison_view(
+    session_id: Optional[str],
+    speed_computation_mode: SpeedComputationMode,
+) -> Optional[FocusComparisonView]:
+    def build(results):
+        return FocusComparisonView(
+            select_results_speed_computation_mode(results, speed_computation_mode)
+        )
+
+    return result_store.view(
+        session_id, "focus", ("comparison", speed_computation_mode), build
+    )
+
+
+def insights_view_model(
+    session_id: Optional[str],
+    speed_computation_mode: SpeedComputationMode,
+) -> Optional[InsightsView]:
+    def build(results):
+        return InsightsView(
+            select_results_speed_computation_mode(results, speed_computation_mode)
+        )
+
+    return result_store.view(session_id, "insights", speed_computation_mode, build)